@@ -12,17 +12,22 @@ from keras.callbacks import ModelCheckpoint
 from keras import optimizers
 from keras.layers import Input
 from keras.models import Model, load_model
-from keras.preprocessing.image import list_pictures
-from tools.get_data import get_zone
+from keras.utils import Sequence
+from keras import backend as K
 from matplotlib import pyplot as plt
 import copy
-import tools.point_check as point_check
+import tools.label_engine as label_engine
+import tools.label_cache as label_cache
+import tools.geometry as geometry
+import tools.annotation_store as annotation_store
+import tools.shard as shard
+import tools.h5_dataset as h5_dataset
+import tools.image_cache as image_cache
+import tools.sampler as sampler
+import tools.online_crop as online_crop
 import cv2
-import string
 import numpy as np
 import os
-import re
-import h5py
 import tensorflow as tf
 import datetime
 
@@ -44,26 +49,10 @@ def read_multi_h5file(filelist):
     """
     read multi h5 file
     :param filelist:
-    :return: network input X and output Y
+    :return: h5_dataset.MultiH5Dataset object, lazy view of network input X and output Y of all files,
+             only the rows of each batch are read, see H5Sequence
     """
-    read = h5py.File(filelist[0], 'r')
-    x_train = read['X_train'][:]
-    y_1_cls = read['Y_train_cls'][:]
-    y_2_mer = read['Y_train_merge'][:]
-    read.close()
-
-    for idx in range(1, len(filelist)):
-        read = h5py.File(filelist[idx], 'r')
-        x_ite = read['X_train'][:]
-        y_1_cls_ite = read['Y_train_cls'][:]
-        y_2_mer_ite = read['Y_train_merge'][:]
-        read.close()
-        x_train = np.concatenate((x_train, x_ite))
-        y_1_cls = np.concatenate((y_1_cls, y_1_cls_ite))
-        y_2_mer = np.concatenate((y_2_mer, y_2_mer_ite))
-
-    y_train = [y_1_cls, y_2_mer]
-    return x_train, y_train
+    return h5_dataset.MultiH5Dataset(filelist)
 
 
 def l2(y_true, y_pred):
@@ -168,8 +157,25 @@ def new_smooth(y_true, y_pred):
     return lambda_loc * loss
 
 
-def multi_task_improve(input_tensor):
-    im_input = BatchNormalization()(input_tensor)
+def normalize_input(input_tensor):
+    """
+    normalize uint8 images from [0, 255] to [0, 1] in the graph, so batches are fed as uint8 (1 byte per pixel)
+    instead of normalized on the host as float32
+    :param input_tensor: uint8 input image tensor, e.g. Input(shape, dtype='uint8')
+    :return: float32 tensor
+    """
+    return Lambda(lambda t: K.cast(t, 'float32') / 255.0, name='normalize_input')(input_tensor)
+
+
+def multi_task_improve(input_tensor, stride=4, uint8_input=False):
+    """
+    multi-task network, classification and regression share the feature map
+    :param input_tensor: input image tensor, image size should be divisible by 64
+    :param stride: input image size / output feature map size, 4, 8 or 16, see tools.geometry
+    :param uint8_input: input_tensor is uint8 images in [0, 255], normalized in the graph, see normalize_input
+    :return: A list [classification output, regression output, regression output before scaling]
+    """
+    im_input = BatchNormalization()(normalize_input(input_tensor) if uint8_input else input_tensor)
 
     # conv_1
     conv1_1 = Convolution2D(32, (5, 5), strides=(1, 1), padding='same',
@@ -241,22 +247,35 @@ def multi_task_improve(input_tensor):
     # fuse_pool3 = add([upscore8, pool3_for_fuse])
     fuse_pool3 = add([upscore8, pool3])
 
-    upscore16 = Conv2DTranspose(filters=128, kernel_size=(2, 2),
-                                strides=(2, 2), padding='valid', use_bias=False,
-                                name='upscore16')(fuse_pool3)
+    # output feature map of the given stride
+    if stride == 16:
+        feat_map = fuse_pool4
+    elif stride == 8:
+        feat_map = fuse_pool3
+    else:
+        feat_map = Conv2DTranspose(filters=128, kernel_size=(2, 2),
+                                   strides=(2, 2), padding='valid', use_bias=False,
+                                   name='upscore16')(fuse_pool3)
     ##########################################################################
     # shared layer
     ##########################################################################
-    x_clas = Convolution2D(1, (1, 1), strides=(1, 1), padding='same', name='cls')(upscore16)
-    # x_clas = Convolution2D(1, (1, 1), strides=(1, 1), padding='same', name='cls', activation='sigmoid')(upscore16)
-    x = Convolution2D(128, (1, 1), strides=(1, 1), padding='same', activation='relu')(upscore16)
+    x_clas = Convolution2D(1, (1, 1), strides=(1, 1), padding='same', name='cls')(feat_map)
+    # x_clas = Convolution2D(1, (1, 1), strides=(1, 1), padding='same', name='cls', activation='sigmoid')(feat_map)
+    x = Convolution2D(128, (1, 1), strides=(1, 1), padding='same', activation='relu')(feat_map)
     x = Convolution2D(8, (1, 1), strides=(1, 1), padding='same', activation='sigmoid')(x)
     x_regr = Lambda(lambda t: 800 * t - 400)(x)
     return [x_clas, x_regr, x]
 
 
-def multi_task(input_tensor):
-    im_input = BatchNormalization()(input_tensor)
+def multi_task(input_tensor, stride=4, uint8_input=False):
+    """
+    multi-task network, classification and regression share the feature map
+    :param input_tensor: input image tensor, image size should be divisible by 64
+    :param stride: input image size / output feature map size, 4, 8 or 16, see tools.geometry
+    :param uint8_input: input_tensor is uint8 images in [0, 255], normalized in the graph, see normalize_input
+    :return: A list [classification output, regression output, regression output before scaling]
+    """
+    im_input = BatchNormalization()(normalize_input(input_tensor) if uint8_input else input_tensor)
 
     # conv_1
     conv1_1 = Convolution2D(32, (5, 5), strides=(1, 1), padding='same',
@@ -323,59 +342,108 @@ def multi_task(input_tensor):
                                name='upscore8')(fuse_pool4)
     fuse_pool3 = add([upscore8, pool3_for_fuse])
 
-    upscore16 = Conv2DTranspose(filters=128, kernel_size=(2, 2),
-                                strides=(2, 2), padding='valid', use_bias=False,
-                                name='upscore16')(fuse_pool3)
+    # output feature map of the given stride
+    if stride == 16:
+        feat_map = fuse_pool4
+    elif stride == 8:
+        feat_map = fuse_pool3
+    else:
+        feat_map = Conv2DTranspose(filters=128, kernel_size=(2, 2),
+                                   strides=(2, 2), padding='valid', use_bias=False,
+                                   name='upscore16')(fuse_pool3)
     ##########################################################################
     # shared layer
     ##########################################################################
-    x_clas = Convolution2D(1, (1, 1), strides=(1, 1), padding='same', name='cls')(upscore16)
-    # x_clas = Convolution2D(1, (1, 1), strides=(1, 1), padding='same', name='cls', activation='sigmoid')(upscore16)
-    x = Convolution2D(128, (1, 1), strides=(1, 1), padding='same', activation='relu')(upscore16)
+    x_clas = Convolution2D(1, (1, 1), strides=(1, 1), padding='same', name='cls')(feat_map)
+    # x_clas = Convolution2D(1, (1, 1), strides=(1, 1), padding='same', name='cls', activation='sigmoid')(feat_map)
+    x = Convolution2D(128, (1, 1), strides=(1, 1), padding='same', activation='relu')(feat_map)
     x = Convolution2D(8, (1, 1), strides=(1, 1), padding='same', activation='sigmoid')(x)
     x_regr = Lambda(lambda t: 800 * t - 400)(x)
     return [x_clas, x_regr, x]
 
 
-def img_txtreg_generator(jpgs_list, crop_size=320, scale=1):
+def load_source(directory):
+    """
+    :param directory: jpg files directory, shard directory written by tools.shard, or split list written by
+                      tools.split_dataset
+    :return: shard.ShardReader object for a shard directory, else annotation_store.AnnotationStore object
     """
-    a python generator, read image's text region from txt file
-    :param jpgs_list: list, storing all jpgs's path
+    if shard.is_shard_dir(directory):
+        return shard.ShardReader(directory)
+    # jpg and txt pairs come from the directory's manifest, text regions are parsed once and saved next to it,
+    # a split list takes it's images' text regions from their directory
+    return annotation_store.load_images(directory)
+
+
+def read_img_txtreg(source, idx, crop_size=320, input_size=None, img_cache=None, augment=None, rng=np.random):
+    """
+    read a cropped image and it's text region
+    :param source: annotation_store.AnnotationStore or shard.ShardReader object
+    :param idx: image index of source
+    :param crop_size: cropped image size
+    :param input_size: network input size, image and text region are resized to it, None means crop_size
+    :param img_cache: image_cache.ImageCache object, None means decoding the image every time
+    :param augment: online_crop.TextCenterCrop object, source has full size images which are cropped (and rotated)
+                    online, None means source has cropped images
+    :param rng: numpy.random.RandomState object of augment
+    :return: A tuple (numpy array of image, text region numpy array), None if the image is not usable
+             the image is read-only if it is from img_cache
+    """
+    # images without text region are rejected before decoding, tools.check_dataset removes them up front
+    if len(source.txtreg(idx)) == 0:
+        return None
+    if img_cache is not None:
+        img_nparr, txtreg = img_cache.read(source, idx)
+    else:
+        img_nparr, txtreg = source.read_image(idx), source.txtreg(idx)
+    # ensure jpg file is not empty
+    if img_nparr is None:
+        return None
+    if augment is not None:
+        sample = augment(img_nparr, txtreg, rng)
+        if sample is None:
+            return None
+        img_nparr, txtreg = sample
+    # ensure jpg file's shape is 320 * 320
+    if img_nparr.shape[0] != crop_size or img_nparr.shape[1] != crop_size:
+        return None
+    if input_size is not None and input_size != crop_size:
+        img_nparr = cv2.resize(img_nparr, (input_size, input_size), interpolation=cv2.INTER_AREA)
+        txtreg = txtreg * (float(input_size) / crop_size)
+    return img_nparr, txtreg
+
+
+def img_txtreg_generator(source, crop_size=320, scale=1, dtype=np.float32, input_size=None, img_cache=None,
+                         epoch_sampler=None, one_epoch=False, augment=None):
+    """
+    a python generator, read image and it's text region
+    :param source: annotation_store.AnnotationStore or shard.ShardReader object
     :param crop_size: cropped image size
-    :param scale: normalization parameter
-    :return: A list [numpy array of image(normalized), text region list]
+    :param input_size: network input size, None means crop_size
+    :param img_cache: image_cache.ImageCache object, None means decoding the image every time
+    :param scale: normalization parameter, None means yielding the raw uint8 image (normalized in the model)
+    :param dtype: dtype of normalized image, np.float32 or np.float16
+    :param epoch_sampler: sampler.EpochSampler object over source, None means all images shuffled every epoch
+    :param one_epoch: stop at the end of the sampler's current epoch, False means endless
+    :param augment: online_crop.TextCenterCrop object for full size images, see read_img_txtreg
+    :return: A list [numpy array of image(normalized), text region numpy array]
     """
     vis = False
-    while True:
-        # a list stores image's text region
-        text_reg_list = []
-        # choose a image randomly from all images
-        jpg_path = np.random.choice(jpgs_list)
-        img_nparr = cv2.imread(jpg_path)
-        # get image's txt file path
-        pattern = re.compile('jpg')
-        txt_path = pattern.sub('txt', jpg_path)
-        # ensure jpg file has a correspongding txt file
-        if not os.path.isfile(txt_path):
-            continue
-        with open(txt_path, 'r') as f:
-            for line in f:
-                line_split = line.strip().split(',')
-                # clockwise
-                (x1, y1, x2, y2) = line_split[0:4]
-                (x3, y3, x4, y4) = line_split[4:8]
-                text_reg_list.append([string.atof(x1), string.atof(y1), string.atof(x2), string.atof(y2),
-                                      string.atof(x3), string.atof(y3), string.atof(x4), string.atof(y4)])
-        # ensure jpg and txt file is not empty
-        if img_nparr is None or text_reg_list is None:
-            continue
-        # ensure jpg file's shape is 320 * 320
-        if img_nparr.shape[0] != crop_size or img_nparr.shape[1] != crop_size:
+    if epoch_sampler is None:
+        epoch_sampler = sampler.EpochSampler(len(source))
+    # every image once per epoch, in a new order every epoch
+    for idx in (epoch_sampler.iter_epoch() if one_epoch else epoch_sampler):
+        jpg_path = source.path(idx)
+        sample = read_img_txtreg(source, idx, crop_size, input_size, img_cache, augment)
+        if sample is None:
             continue
+        img_nparr, text_reg_list = sample
 
         #       ------------------------------ visualise ------------------------------
         if vis:
-            print 'txt_path is {0}'.format(txt_path)
+            print 'jpg_path is {0}'.format(jpg_path)
+            # the cached image is read-only
+            img_nparr = img_nparr.copy()
             for bbox in text_reg_list:
                 print 'bbox is {0}'.format(bbox)
                 # coordinates must be int type
@@ -388,47 +456,44 @@ def img_txtreg_generator(jpgs_list, crop_size=320, scale=1):
             plt.imshow(img_nparr)
             plt.show()
         #       ------------------------------ visualise ------------------------------
+        if scale is None:
+            yield [img_nparr, text_reg_list]
+            continue
         # normalize image data from [0, 255] to [0, 1]
-        scaled_img = scale * img_nparr
+        scaled_img = np.multiply(img_nparr, scale, dtype=dtype)
         yield [scaled_img, text_reg_list]
 
 
-def image_ylabel_generator(images):
+def gene_ylabel(img_shape, txtreg, cache=None, geom=geometry.DEFAULT):
+    """
+    generate a image's classification, mask and regression label
+    :param img_shape: image shape, (height, width, channel)
+    :param txtreg: text region list or numpy array (N, 8)
+    :param cache: label_cache.LabelCache object, None means generating labels every time
+    :param geom: geometry.Geometry object, should be the same as cache's geometry
+    :return: A tuple (y_cls_mask_label, y_regr_cls_mask_label)
+    """
+    if cache is not None:
+        return cache.get_or_gene(img_shape, txtreg)
+    return label_engine.gene_labels(img_shape, txtreg, geom)
+
+
+def image_ylabel_generator(images, cache=None, geom=geometry.DEFAULT):
     """
 
     :param images:
+    :param cache: label_cache.LabelCache object, read generated labels from disk instead of generating again
+    :param geom: geometry.Geometry object, output feature map size and stride
     :return:
     """
     vis = False
     for img, txtreg in images:
-        # 1) generate imput data, input data is (320, 320, 3)
-
-        # 2) generate clsssification data
-        # split text region into gray_zone_list and posi_zone_list
-        # gray_zone_list is a list, each element represent a gray zone
-        gray_zone_list, posi_zone_list = get_zone(txtreg)
-        # x-axis and y-axis reduced scale
-        reduced_x, reduced_y = float(img.shape[1]) / 80.0, float(img.shape[0]) / 80.0
-        mask_label = np.ones((80, 80))
-        y_class_label = np.zeros((80, 80))  # negative lable is 0
-        for ix in xrange(y_class_label.shape[0]):
-            for jy in xrange(y_class_label.shape[1]):
-                for posi in posi_zone_list:
-                    x1, x2 = posi[0] / reduced_x, posi[2] / reduced_x
-                    x3, x4 = posi[4] / reduced_x, posi[6] / reduced_x
-                    y1, y2 = posi[1] / reduced_y, posi[3] / reduced_y
-                    y3, y4 = posi[5] / reduced_y, posi[7] / reduced_y
-                    posi_poly = [(x1, y1), (x2, y2), (x3, y3), (x4, y4)]
-                    if point_check.point_in_polygon(ix, jy, posi_poly):
-                        y_class_label[ix][jy] = 1
-                for gray in gray_zone_list:
-                    x1, x2 = gray[0] / reduced_x, gray[2] / reduced_x
-                    x3, x4 = gray[4] / reduced_x, gray[6] / reduced_x
-                    y1, y2 = gray[1] / reduced_y, gray[3] / reduced_y
-                    y3, y4 = gray[5] / reduced_y, gray[7] / reduced_y
-                    gray_poly = [(x1, y1), (x2, y2), (x3, y3), (x4, y4)]
-                    if point_check.point_in_polygon(ix, jy, gray_poly):
-                        mask_label[ix][jy] = 0
+        # 1) generate imput data, input data is (input_size, input_size, 3)
+
+        # 2) generate clsssification, mask and regression data
+        # text region is split into gray zone and positive zone inside the label engine
+        y_cls_mask_label, y_regr_cls_mask_label = gene_ylabel(img.shape, txtreg, cache, geom)
+        y_class_label, mask_label = y_cls_mask_label[:, :, 0], y_cls_mask_label[:, :, 1]
         #       ------------------------------ visualise ------------------------------
         if vis:
             # raw image
@@ -444,7 +509,7 @@ def image_ylabel_generator(images):
             for ix in xrange(y_class_label.shape[0]):
                 for jy in xrange(y_class_label.shape[0]):
                     if y_class_label[ix][jy] == 1:
-                        cv2.circle(plt_img, (int(ix) * 4, int(jy) * 4), radius=1, color=(0, 255, 0))
+                        cv2.circle(plt_img, (int(ix) * geom.stride, int(jy) * geom.stride), radius=1, color=(0, 255, 0))
             plt.subplot(222)
             plt.imshow(plt_img)
 
@@ -453,34 +518,28 @@ def image_ylabel_generator(images):
             for ix in xrange(mask_label.shape[0]):
                 for jy in xrange(mask_label.shape[0]):
                     if mask_label[ix][jy] == 0:
-                        cv2.circle(mask_img, (int(ix) * 4, int(jy) * 4), 1, color=(255, 0, 0))
+                        cv2.circle(mask_img, (int(ix) * geom.stride, int(jy) * geom.stride), 1, color=(255, 0, 0))
             plt.subplot(224)
             plt.imshow(mask_img)
 
             plt.show()
         #       ------------------------------ visualise ------------------------------
-        # calculate ones's locations before expand the dimension of y_class_label
-        one_locs = np.where(y_class_label > 0)
         # deep copy for visualize
         copy_class = copy.deepcopy(y_class_label)
         copy_mask = copy.deepcopy(mask_label)
-        # print 'y_cls_lable {0}'.format(y_class_label)
-        y_class_label = np.expand_dims(y_class_label, axis=-1)
-        # print 'y_cls_lable {0}'.format(y_class_label)
-        mask_label = np.expand_dims(mask_label, axis=-1)
         #       ------------------------------ visualise ------------------------------
         if vis:
             plt.subplot(221)
             plt.imshow(img)
 
             plt.subplot(222)
-            x, y = np.meshgrid(np.arange(0, 80), np.arange(0, 80))
+            x, y = np.meshgrid(np.arange(0, geom.out_size), np.arange(0, geom.out_size))
             copy_class = np.rot90(copy_class, 1).tolist()
             plt.pcolormesh(x, y, copy_class)
             plt.colorbar()  # need a colorbar to show the intensity scale
 
             plt.subplot(224)
-            x, y = np.meshgrid(np.arange(0, 80), np.arange(0, 80))
+            x, y = np.meshgrid(np.arange(0, geom.out_size), np.arange(0, geom.out_size))
             copy_mask = np.rot90(copy_mask, 1).tolist()
             plt.pcolormesh(x, y, copy_mask)
             plt.colorbar()  # need a colorbar to show the intensity scale
@@ -488,72 +547,318 @@ def image_ylabel_generator(images):
             plt.show()
         #       ------------------------------ visualise ------------------------------
 
-        # 3) generate regression data
-        y_regr_lable = np.zeros((80, 80, 8))
-        # visit all text pixel
-        for idx in xrange(len(one_locs[0])):
-            # judge text pixel belong to which box
-            for polygon in txtreg:
-                x1, x2 = polygon[0] / reduced_x, polygon[2] / reduced_x
-                x3, x4 = polygon[4] / reduced_x, polygon[6] / reduced_x
-                y1, y2 = polygon[1] / reduced_y, polygon[3] / reduced_y
-                y3, y4 = polygon[5] / reduced_y, polygon[7] / reduced_y
-                # 80 * 80 image's quardrangle
-                quard = [(x1, y1), (x2, y2), (x3, y3), (x4, y4)]
-                ix = one_locs[0][idx]
-                jy = one_locs[1][idx]
-                # (ix, jy) pixel belong to quardragle quard
-                if point_check.point_in_polygon(ix, jy, quard):
-                    top_left_x, top_left_y = quard[0][0], quard[0][1]
-                    top_righ_x, top_righ_y = quard[1][0], quard[1][1]
-                    dow_righ_x, dow_righ_y = quard[2][0], quard[2][1]
-                    dow_left_x, dow_left_y = quard[3][0], quard[3][1]
-
-                    y_regr_lable[ix][jy][0] = top_left_x * 4 - ix * 4
-                    y_regr_lable[ix][jy][1] = top_left_y * 4 - jy * 4
-                    y_regr_lable[ix][jy][2] = top_righ_x * 4 - ix * 4
-                    y_regr_lable[ix][jy][3] = top_righ_y * 4 - jy * 4
-                    y_regr_lable[ix][jy][4] = dow_righ_x * 4 - ix * 4
-                    y_regr_lable[ix][jy][5] = dow_righ_y * 4 - jy * 4
-                    y_regr_lable[ix][jy][6] = dow_left_x * 4 - ix * 4
-                    y_regr_lable[ix][jy][7] = dow_left_y * 4 - jy * 4
-        y_regr_cls_mask_label = np.concatenate((y_regr_lable, y_class_label, mask_label), axis=-1)
-        y_cls_mask_label = np.concatenate((y_class_label, mask_label), axis=-1)
         yield (img, y_cls_mask_label, y_regr_cls_mask_label)
 
 
-def group_by_batch(dataset, batch_size):
+def group_by_batch(dataset, batch_size, ring_size=None, partial='keep', max_queue_size=10, workers=1):
     """
-
-    :param dataset:
-    :param batch_size:
-    :return:
+    assemble batches in a ring of preallocated batch arrays, samples are copied into the arrays once
+    the arrays are allocated on the first sample with it's shapes and dtypes, then reused every ring_size batches,
+    so a batch must be consumed before ring_size more batches are produced: ring_size must be larger than the number
+    of batches the consumer holds, fit_generator's max_queue_size + workers + 1 with threads (batches are copied to
+    the consumer with use_multiprocessing=True)
+    :param dataset: iterable of (img, y_cls_mask_label, y_regr_cls_mask_label), may be endless
+    :param batch_size: batch size
+    :param ring_size: number of preallocated batches, None means max_queue_size + workers + 2, ValueError if it is
+                      not larger than max_queue_size + workers + 1
+    :param partial: the last samples of a finite dataset, 'keep' yields a smaller batch, 'drop' discards them
+    :param max_queue_size: max_queue_size of the consumer, 10 is the default of fit_generator
+    :param workers: workers of the consumer, 1 is the default of fit_generator
+    :return: python generator, (img, [y_cls_mask_label, y_regr_cls_mask_label]), views of the ring arrays
     """
-    while True:
-        img, y_cls_mask_label, y_regr_cls_mask_label = zip(*[dataset.next() for i in xrange(batch_size)])
-        batch = (np.stack(img), [np.stack(y_cls_mask_label), np.stack(y_regr_cls_mask_label)])
-        yield batch
-
-
-def load_dataset(directory, crop_size=320, batch_size=32):
+    if partial not in ('keep', 'drop'):
+        raise ValueError('unknown partial batch policy {0}'.format(partial))
+    min_ring_size = max_queue_size + workers + 2
+    if ring_size is None:
+        ring_size = min_ring_size
+    if ring_size < min_ring_size:
+        raise ValueError('ring of {0} batches is overwritten while queued, the consumer holds up to {1} batches (queue '
+                         '{2} + workers {3} + 1)'.format(ring_size, min_ring_size - 1, max_queue_size, workers))
+    ring = None
+    slot, row = 0, 0
+    for sample in dataset:
+        if ring is None:
+            ring = [[np.empty((batch_size, ) + np.shape(array), dtype=np.asarray(array).dtype) for array in sample]
+                    for _ in xrange(ring_size)]
+        for buf, array in zip(ring[slot], sample):
+            buf[row] = array
+        row += 1
+        if row == batch_size:
+            img, y_cls_mask_label, y_regr_cls_mask_label = ring[slot]
+            yield img, [y_cls_mask_label, y_regr_cls_mask_label]
+            slot, row = (slot + 1) % ring_size, 0
+    if row > 0 and partial == 'keep':
+        img, y_cls_mask_label, y_regr_cls_mask_label = ring[slot]
+        yield img[:row], [y_cls_mask_label[:row], y_regr_cls_mask_label[:row]]
+
+
+def load_dataset(directory, crop_size=320, batch_size=32, cache=None, geom=geometry.DEFAULT, img_cache=None,
+                 epoch_sampler=None, ring_size=None, partial='keep', scale=1/255.0, augment=None, max_queue_size=10,
+                 workers=1):
     """
     load data from directory
-    :param directory: jpg files directory
+    :param directory: jpg files directory, shard directory written by tools.shard, or split list written by
+                      tools.split_dataset
     :param crop_size: cropped image size
     :param batch_size: batch size
+    :param cache: label_cache.LabelCache object, None means generating labels every time
+    :param geom: geometry.Geometry object, images are resized to geom.input_size
+    :param img_cache: image_cache.ImageCache object, can be shared by the training and validation data
+    :param epoch_sampler: sampler.EpochSampler object, e.g. one shard of the images for each loader process,
+                          None means all images shuffled every epoch
+    :param ring_size: number of preallocated batches, None means large enough for max_queue_size and workers,
+                      see group_by_batch
+    :param partial: the last samples of a epoch, 'keep' yields a smaller batch (ceil(n / batch_size) batches per
+                    epoch), 'drop' discards them (n // batch_size batches per epoch)
+    :param scale: normalization parameter, None means uint8 images for a model with uint8 input
+    :param augment: online_crop.TextCenterCrop object, directory has full size images which are cropped online
+    :param max_queue_size: max_queue_size passed to fit_generator
+    :param workers: workers passed to fit_generator
     :return: python generator object, a batch training data, img, y_cls_mask_lable, y_regr_cls_mask_label
+             with fit_generator(use_multiprocessing=True) every worker process runs a copy of the generator, use
+             workers=1, or load_sequence for several workers
+    """
+    source = load_source(directory)
+    if len(source) == 0:
+        raise ValueError('no image in {0}'.format(directory))
+    if epoch_sampler is None:
+        epoch_sampler = sampler.EpochSampler(len(source))
+    while True:
+        # batches do not cross epochs, every epoch starts with a full batch
+        generator = img_txtreg_generator(source, crop_size, scale=scale, input_size=geom.input_size,
+                                         img_cache=img_cache, epoch_sampler=epoch_sampler, one_epoch=True,
+                                         augment=augment)
+        generator = image_ylabel_generator(generator, cache, geom)
+        num_batches = 0
+        for batch in group_by_batch(generator, batch_size, ring_size, partial, max_queue_size, workers):
+            num_batches += 1
+            yield batch
+        # every epoch of the sampler is the same images, a epoch without batch would repeat forever
+        if num_batches == 0:
+            raise ValueError('no batch in a epoch of {0}, images without text region or not {1} * {1}, or fewer '
+                             'usable images than batch size with partial=\'drop\'?'.format(directory, crop_size))
+
+
+
+class CropSequence(Sequence):
+    """
+    indexable training data over cropped images (jpg files or shards), safe for fit_generator(use_multiprocessing=True)
+    each batch only depends on (seed, epoch, batch index), so every worker process draws the same random numbers
+    for the same batch no matter which worker builds it
+    a epoch visits every image once, the order is given by a sampler.EpochSampler
+    with augment, the images are full size images and a epoch draws one online crop of every image
     """
-    jpg_list = list_pictures(directory, 'jpg')
-    generator = img_txtreg_generator(jpg_list, crop_size, scale=1/255.0)
-    generator = image_ylabel_generator(generator)
-    generator = group_by_batch(generator, batch_size)
-    return generator
+    def __init__(self, source, batch_size=32, crop_size=320, scale=1/255.0, cache=None, seed=0,
+                 dtype=np.float32, geom=geometry.DEFAULT, img_cache=None, shuffle=True, initial_epoch=0,
+                 augment=None, max_retries=100, reuse_buffers=False):
+        """
+        :param source: annotation_store.AnnotationStore or shard.ShardReader object
+        :param batch_size: batch size
+        :param crop_size: cropped image size
+        :param scale: normalization parameter, None means uint8 images for a model with uint8 input
+        :param cache: label_cache.LabelCache object, None means generating labels every time
+        :param seed: random seed of shuffling
+        :param dtype: dtype of normalized image, np.float32 or np.float16
+        :param geom: geometry.Geometry object, images are resized to geom.input_size
+        :param img_cache: image_cache.ImageCache object, each worker process has it's own copy
+        :param shuffle: shuffle images every epoch, False for validation
+        :param initial_epoch: epoch number of the first epoch, e.g. initial_epoch of fit_generator when resuming
+        :param augment: online_crop.TextCenterCrop object, crops (and rotates) the full size images of source online,
+                        a label cache only pays off without jitter (a finite set of crops)
+        :param max_retries: number of random samples tried in place of a unusable sample, ValueError if none of
+                            them is usable (e.g. a source of images without text region)
+        :param reuse_buffers: assemble every batch in the same preallocated arrays of each worker process, only with
+                              fit_generator(use_multiprocessing=True), which copies a batch to the trainer before the
+                              worker builds the next one, False allocates the arrays of each batch
+        """
+        self.source = source
+        self.batch_size = batch_size
+        self.crop_size = crop_size
+        self.scale = scale
+        self.cache = cache
+        self.seed = seed
+        self.dtype = dtype
+        self.geom = geom
+        self.img_cache = img_cache
+        self.augment = augment
+        self.max_retries = max_retries
+        self.reuse_buffers = reuse_buffers
+        self._buffers = None
+        self._pid = None
+        self.sampler = sampler.EpochSampler(len(source), seed, shuffle)
+        self.sampler.set_epoch(initial_epoch)
+        self.epoch = initial_epoch
+        self.order = self.sampler.epoch_indices(self.epoch)
+
+    def __len__(self):
+        # the last batch may be smaller, so a epoch covers every image
+        return int(np.ceil(len(self.source) / float(self.batch_size)))
+
+    def _batch_buffers(self, sample):
+        """
+        :param sample: (img, y_cls_mask_label, y_regr_cls_mask_label) of the first sample of a batch
+        :return: list of batch arrays, the same arrays for every batch of a process if reuse_buffers
+        """
+        # buffers of the parent process are not used by the forked worker processes
+        if self.reuse_buffers and self._buffers is not None and self._pid == os.getpid():
+            return self._buffers
+        dtypes = [sample[0].dtype if self.scale is None else self.dtype, sample[1].dtype, sample[2].dtype]
+        buffers = [np.empty((self.batch_size, ) + array.shape, dtype=dtype) for array, dtype in zip(sample, dtypes)]
+        if self.reuse_buffers:
+            self._buffers, self._pid = buffers, os.getpid()
+        return buffers
+
+    def __getitem__(self, idx):
+        """
+        :param idx: batch index
+        :return: A tuple (img, [y_cls_mask_label, y_regr_cls_mask_label]), same as group_by_batch
+        """
+        # per batch random state, replace unusable samples by random samples, also draws the online crops
+        rng = np.random.RandomState([self.seed, self.epoch, idx])
+        batch_indices = self.order[idx * self.batch_size: (idx + 1) * self.batch_size]
+        buffers = None
+        for row, jpg_idx in enumerate(batch_indices):
+            sample = read_img_txtreg(self.source, jpg_idx, self.crop_size, self.geom.input_size, self.img_cache,
+                                     self.augment, rng)
+            for _ in xrange(self.max_retries):
+                if sample is not None:
+                    break
+                jpg_idx = rng.randint(len(self.source))
+                sample = read_img_txtreg(self.source, jpg_idx, self.crop_size, self.geom.input_size, self.img_cache,
+                                         self.augment, rng)
+            if sample is None:
+                raise ValueError('no usable sample in {0} random samples of {1} images, images without text region '
+                                 'or not {2} * {2}?'.format(self.max_retries, len(self.source), self.crop_size))
+            img_nparr, text_reg_list = sample
+            # targets stored in shards, None if not stored, stored targets are not of online crops
+            labels = self.source.labels(jpg_idx, self.geom) if self.augment is None else None
+            if labels is None:
+                labels = gene_ylabel(img_nparr.shape, text_reg_list, self.cache, self.geom)
+            # samples are copied into the batch arrays once
+            if buffers is None:
+                buffers = self._batch_buffers((img_nparr, ) + tuple(labels))
+            for buf, array in zip(buffers, (img_nparr, ) + tuple(labels)):
+                buf[row] = array
+        img, y_cls_mask_label, y_regr_cls_mask_label = [buf[:len(batch_indices)] for buf in buffers]
+        # normalize image data from [0, 255] to [0, 1] in place, or leave it to the model
+        if self.scale is not None:
+            np.multiply(img, self.scale, out=img)
+        return img, [y_cls_mask_label, y_regr_cls_mask_label]
+
+    def on_epoch_end(self):
+        # reshuffle, keras sends the updated sequence to the worker processes before the next epoch
+        self.epoch += 1
+        self.sampler.set_epoch(self.epoch)
+        self.order = self.sampler.epoch_indices(self.epoch)
+
+
+class H5Sequence(Sequence):
+    """
+    shuffled minibatches of a h5_dataset.MultiH5Dataset, only the rows of each batch are read from disk,
+    so the training data can be larger than memory
+    """
+    def __init__(self, dataset, indices, batch_size=64, seed=0, shuffle=True, scale=1/255.0):
+        """
+        :param dataset: h5_dataset.MultiH5Dataset object
+        :param indices: global sample indices of this sequence, e.g. training or validation part
+        :param batch_size: batch size
+        :param seed: random seed of shuffling
+        :param shuffle: shuffle samples every epoch
+        :param scale: normalization parameter of uint8 images, images stored as float are normalized already,
+                      None means uint8 images for a model with uint8 input
+        """
+        self.dataset = dataset
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.batch_size = batch_size
+        self.scale = scale
+        self.seed = seed
+        self.shuffle = shuffle
+        self.sampler = sampler.EpochSampler(len(self.indices), seed, shuffle)
+        self.epoch = 0
+        self.order = self._epoch_order()
+
+    def _epoch_order(self):
+        return self.indices[self.sampler.epoch_indices(self.epoch)]
+
+    def __len__(self):
+        # the last batch may be smaller, same as fit
+        return int(np.ceil(len(self.indices) / float(self.batch_size)))
+
+    def __getitem__(self, idx):
+        """
+        :param idx: batch index
+        :return: A tuple (X, [Y_train_cls, Y_train_merge])
+        """
+        x_batch, y_cls_batch, y_merge_batch = self.dataset.read(self.order[idx * self.batch_size:
+                                                                           (idx + 1) * self.batch_size])
+        if x_batch.dtype == np.uint8 and self.scale is not None:
+            # normalize image data from [0, 255] to [0, 1]
+            x_batch = np.multiply(x_batch, self.scale, dtype=np.float32)
+        return x_batch, [y_cls_batch, y_merge_batch]
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self.order = self._epoch_order()
+
+
+def load_sequence(directory, crop_size=320, batch_size=32, cache=None, seed=0, geom=geometry.DEFAULT,
+                  img_cache=None, shuffle=True, initial_epoch=0, scale=1/255.0, augment=None, reuse_buffers=False):
+    """
+    load data from directory as a keras Sequence, use it with fit_generator(workers=n, use_multiprocessing=True)
+    :param directory: jpg files directory, shard directory written by tools.shard, or split list written by
+                      tools.split_dataset
+    :param crop_size: cropped image size
+    :param batch_size: batch size
+    :param cache: label_cache.LabelCache object, None means generating labels every time
+    :param seed: random seed of shuffling
+    :param geom: geometry.Geometry object, images are resized to geom.input_size
+    :param img_cache: image_cache.ImageCache object, can be shared by the training and validation data
+    :param shuffle: shuffle images every epoch, False for validation
+    :param initial_epoch: epoch number of the first epoch, e.g. initial_epoch of fit_generator when resuming
+    :param scale: normalization parameter, None means uint8 images for a model with uint8 input
+    :param augment: online_crop.TextCenterCrop object, directory has full size images which are cropped online
+    :param reuse_buffers: preallocated batch arrays per worker process, only with use_multiprocessing=True, see
+                          CropSequence
+    :return: CropSequence object, len() batches cover every image once
+    """
+    return CropSequence(load_source(directory), batch_size, crop_size, scale, cache, seed,
+                        geom=geom, img_cache=img_cache, shuffle=shuffle, initial_epoch=initial_epoch, augment=augment,
+                        reuse_buffers=reuse_buffers)
+
+
+def test_label_cache_warm(directory, cache_dir, geom=geometry.get_geometry('fast'), crop_size=320, num_images=64):
+    """
+    warm a label cache with python -m tools.label_cache's LabelCache.warm, then read the same images through the
+    training path (read_img_txtreg and gene_ylabel), every label of a usable image should be a cache hit
+    :param directory: directory of crop_size * crop_size crops
+    :param cache_dir: cache directory of the test, use a empty directory
+    :param geom: geometry.Geometry object, a geometry whose input size is not crop_size checks the scaling
+    :param crop_size: cropped image size
+    :param num_images: number of images of the test
+    """
+    store = annotation_store.load_images(directory)
+    store = store.select(np.arange(min(num_images, len(store))))
+    cache = label_cache.LabelCache(cache_dir, geom=geom)
+    num_gene = cache.warm(store, crop_size)
+    cache.hits, cache.misses = 0, 0
+    for idx in xrange(len(store)):
+        sample = read_img_txtreg(store, idx, crop_size, geom.input_size)
+        if sample is not None:
+            gene_ylabel(sample[0].shape, sample[1], cache, geom)
+    print '{0} warmed entries, {1} hits, {2} misses'.format(num_gene, cache.hits, cache.misses)
+    assert cache.misses == 0 and cache.hits > 0, 'warmed labels are not found by the training path'
 
 
 if __name__ == '__main__':
     gpu_id = '1'
     os.environ['CUDA_VISIBLE_DEVICES'] = str(gpu_id)
 
+    # warm a label cache of the fast geometry and read it back through the training path
+    test_label_cache = False
+    if test_label_cache:
+        test_label_cache_warm('/home/yuquanjie/Documents/Dataset/icdar/crop_center_rotated',
+                              '/home/yuquanjie/Documents/Dataset/icdar/label_cache_test')
+
     model_name = 'multi_task'
     batch_size = 64
     batch_momentum = 0.9
@@ -569,6 +874,9 @@ if __name__ == '__main__':
         label_dir = os.path.expanduser('/home/yuquanjie/Documents/Dataset/icdar/icdar/data')
         data_suffix = '.jpg'
         label_suffix = '.png'
+        # generated labels cached on disk, see use_label_cache below
+        label_cache_dir = os.path.expanduser('/home/yuquanjie/Documents/Dataset/icdar/label_cache')
+        label_cache_bytes = 8 * 1024 ** 3
 
     if dataset == 'SHUMEI':
         print '2'
@@ -577,11 +885,15 @@ if __name__ == '__main__':
 
 
 
+    # input size and output stride, 'default' is 320 input and 80 * 80 output, see tools.geometry
+    geom = geometry.get_geometry('default')
+    # uint8 images are fed to the model and normalized in the graph, 1 byte per pixel from loader to device
+    uint8_input = True
     # define input
-    img_input = Input((320, 320, 3))
+    img_input = Input((geom.input_size, geom.input_size, 3), dtype='uint8' if uint8_input else 'float32')
     # define network
-    # multi = multi_task_improve(img_input)
-    multi = multi_task(img_input)
+    # multi = multi_task_improve(img_input, geom.stride, uint8_input)
+    multi = multi_task(img_input, geom.stride, uint8_input)
     multitask_model = Model(img_input, multi[0:2])
     # define optimizer
     sgd = optimizers.SGD(lr=0.01, decay=4e-4, momentum=0.9)
@@ -590,36 +902,75 @@ if __name__ == '__main__':
     # resume training, use loading weights(not work, still unknowned reason), not loading model structure
     multitask_model = load_model('model/2017-07-19-18-46-epoch-110-loss-4.09-saved-all-model.hdf5',
                                  custom_objects={'my_hinge': my_hinge, 'new_smooth': new_smooth})
+    # the loaders follow the model, a model with float input (e.g. the resumed one) is fed normalized images
+    scale = None if K.dtype(multitask_model.input) == 'uint8' else 1/255.0
 
     use_generator = True
     if use_generator:
+        # cache generated labels in label_cache_dir, warm it up front with python -m tools.label_cache
+        use_label_cache = False
+        cache = None
+        if use_label_cache:
+            cache = label_cache.LabelCache(label_cache_dir, label_cache_bytes, geom)
+        # decoded images are cached in memory, shared by the training and validation data, one cache per worker
+        use_image_cache = True
+        img_cache = image_cache.ImageCache(1024 ** 3) if use_image_cache else None
+        # epoch number of the resumed model, the data order of a epoch only depends on (seed, epoch)
+        initial_epoch = 114
+        # batches are copied from the worker processes (use_multiprocessing=True below), so each worker assembles
+        # it's batches in the same preallocated arrays
+        reuse_buffers = True
         shumei = False
         if shumei:
-            # shumei data
-            train_set = load_dataset('/home/yuquanjie/Documents/shumei_crop_center', 320, 64)
-            val_set = load_dataset('/home/yuquanjie/Documents/shumei_crop_center', 320, 64)
+            # shumei data, a python generator would be copied into each of the 8 worker processes and yield every
+            # image 8 times per epoch, a Sequence hands each batch to one worker
+            train_set = load_sequence('/home/yuquanjie/Documents/shumei_crop_center', 320, 64, cache, geom=geom,
+                                      img_cache=img_cache, initial_epoch=initial_epoch, scale=scale,
+                                      reuse_buffers=reuse_buffers)
+            val_set = load_sequence('/home/yuquanjie/Documents/shumei_crop_center', 320, 64, cache, geom=geom,
+                                    img_cache=img_cache, shuffle=False, scale=scale, reuse_buffers=reuse_buffers)
         else:
-            # icdar data
-            train_set = load_dataset('/home/yuquanjie/Documents/Dataset/icdar/crop_center_rotated', 320, 64)
-            val_set = load_dataset('/home/yuquanjie/Documents/Dataset/icdar/crop_center_rotated_test', 320, 64)
+            # icdar data, Sequence can be loaded by several worker processes
+            # crop around text centers and rotate the full size images online instead of reading the written crops
+            use_online_crop = False
+            if use_online_crop:
+                train_set = load_sequence('/home/yuquanjie/Documents/Dataset/icdar/icdar', 320, 64, cache, geom=geom,
+                                          img_cache=img_cache, initial_epoch=initial_epoch, scale=scale,
+                                          augment=online_crop.TextCenterCrop(320), reuse_buffers=reuse_buffers)
+            else:
+                train_set = load_sequence('/home/yuquanjie/Documents/Dataset/icdar/crop_center_rotated', 320, 64,
+                                          cache, geom=geom, img_cache=img_cache, initial_epoch=initial_epoch,
+                                          scale=scale, reuse_buffers=reuse_buffers)
+            val_set = load_sequence('/home/yuquanjie/Documents/Dataset/icdar/crop_center_rotated_test', 320, 64,
+                                    cache, geom=geom, img_cache=img_cache, shuffle=False, scale=scale,
+                                    reuse_buffers=reuse_buffers)
+        # every image is trained and validated once per epoch
+        train_steps, val_steps = len(train_set), len(val_set)
 
         date_time = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M')
         filepath = "model/" + date_time + "-epoch-{epoch:02d}-loss-{loss:.2f}-saved-all-model.hdf5"
         checkpoint = ModelCheckpoint(filepath, monitor='loss', verbose=1, save_best_only=True,
                                      save_weights_only=False, mode='min')
         callbacks_list = [checkpoint]
-        multitask_model.fit_generator(train_set, steps_per_epoch=100, epochs=10000, callbacks=callbacks_list,
-                                      validation_data=val_set, validation_steps=1508 // 64, initial_epoch=114)
+        # max_queue_size bounds the number of prefetched batches
+        multitask_model.fit_generator(train_set, steps_per_epoch=train_steps, epochs=10000, callbacks=callbacks_list,
+                                      validation_data=val_set, validation_steps=val_steps, initial_epoch=initial_epoch,
+                                      workers=8, use_multiprocessing=True, max_queue_size=16)
     else:
         print 'reading data from h5 file .....'
         filenamelist = ['dataset/train_1', 'dataset/train_2', 'dataset/train_3']
-        X, Y = read_multi_h5file(filenamelist)
+        h5_data = read_multi_h5file(filenamelist)
         print 'traning data, input shape is {0}, output classifiction shape is {1}, regression shape is {2}'. \
-            format(X.shape, Y[0].shape, Y[1].shape)
+            format(h5_data.shape('X_train'), h5_data.shape('Y_train_cls'), h5_data.shape('Y_train_merge'))
+        # the last 10% samples are validation data, same as fit(validation_split=0.1)
+        num_val = len(h5_data) // 10
+        train_seq = H5Sequence(h5_data, np.arange(len(h5_data) - num_val), batch_size=64, scale=scale)
+        val_seq = H5Sequence(h5_data, np.arange(len(h5_data) - num_val, len(h5_data)), batch_size=64, shuffle=False,
+                             scale=scale)
         # get date and time
         date_time = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M')
         filepath = "model/" + date_time + "-loss-decrease-{epoch:02d}-{loss:.2f}-saved-weights.hdf5"
         checkpoint = ModelCheckpoint(filepath, monitor='loss', verbose=1, save_weights_only=True, mode='min')
         callbacks_list = [checkpoint]
-        multitask_model.fit(X, Y, batch_size=64, epochs=10000, shuffle=True, callbacks=callbacks_list,
-                            verbose=1, validation_split=0.1)
+        multitask_model.fit_generator(train_seq, steps_per_epoch=len(train_seq), epochs=10000, callbacks=callbacks_list,
+                                      verbose=1, validation_data=val_seq, validation_steps=len(val_seq))
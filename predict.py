@@ -12,9 +12,11 @@ import glob
 import tools.point_check as point_check
 import tools.nms as nms
 import tools.draw_loss as draw_loss
+import tools.geometry as geometry
 from PIL import Image, ImageDraw
 from keras.models import model_from_json
 from keras.models import load_model
+from keras import backend as K
 from quiver_engine.server import launch
 
 
@@ -104,19 +106,27 @@ def new_smooth(y_true, y_pred):
     return loss
 
 
-def get_pred_img(all_img):
+def get_pred_img(all_img, input_size=None):
     """
     get image data for predicting
     :param all_img: a lsit containing all image data whcih need to predict
+    :param input_size: network input size, images are resized to input_size * input_size, None means not resized
     :return: image's numpy array
-             image's path
+             image's path and 'ratio', (x ratio, y ratio) of the image size to the network input size, multiply
+             coordinates on the network input by it to get coordinates on the image
     """
     while True:
         for img_path in all_img:
             print img_path
             if os.path.isfile(img_path):
                 im_arr = cv2.imread(img_path)
-                img_path_dict = {'imagePath': img_path}
+                if im_arr is None:
+                    continue
+                ratio = (1.0, 1.0)
+                if input_size is not None and im_arr.shape[0:2] != (input_size, input_size):
+                    ratio = (float(im_arr.shape[1]) / input_size, float(im_arr.shape[0]) / input_size)
+                    im_arr = cv2.resize(im_arr, (input_size, input_size), interpolation=cv2.INTER_AREA)
+                img_path_dict = {'imagePath': img_path, 'ratio': ratio}
                 yield np.copy(im_arr), img_path_dict
 
 
@@ -149,13 +159,22 @@ if __name__ == '__main__':
 
     # all_imgs = glob.glob('/home/yuquanjie/Documents/shumei_crop_center_test/' + '*.jpg')
     all_imgs = glob.glob('/home/yuquanjie/Documents/icdar2017_crop_center/' + '*.jpg')
-    # python generator
-    data_gen_pred = get_pred_img(all_imgs)
+    # input size and output stride of the loaded model
+    input_size = multitask_model.input_shape[1]
+    geom = geometry.Geometry(input_size, input_size // multitask_model.output_shape[0][1])
+    stride = geom.stride
+    # python generator, images are resized to the model's input size
+    data_gen_pred = get_pred_img(all_imgs, geom.input_size)
+    # all out_size * out_size feature map pixels as (ix, jy) points
+    feat_map_points = geom.grid_points
     while True:
         X, img_data = data_gen_pred.next()
         # predict
         X = np.expand_dims(X, axis=0)
-        predict_all = multitask_model.predict_on_batch(1/255.0 * X)
+        # a model with uint8 input normalizes images in the graph
+        if K.dtype(multitask_model.input) != 'uint8':
+            X = np.multiply(X, 1/255.0, dtype=np.float32)
+        predict_all = multitask_model.predict_on_batch(X)
         # 1) classification result
         predict_cls = predict_all[0]
         # reduce dimension from (1, 80, 80, 1) to (80, 80)
@@ -163,8 +182,8 @@ if __name__ == '__main__':
         predict_cls = np.sum(predict_cls, axis=0)
         # the pixel of text region on 80 * 80 feature map
         one_locs = np.where(predict_cls > 0.6)
-        # the pixel of text region on 320 * 320 raw image
-        coord = [one_locs[0] * 4, one_locs[1] * 4]
+        # the pixel of text region on the input_size * input_size network input
+        coord = [geom.grid_x[one_locs], geom.grid_y[one_locs]]
 
         # 2) regression result
         predict_regr = predict_all[1]
@@ -187,22 +206,21 @@ if __name__ == '__main__':
             if not use_aver_score:
                 score.append(predict_cls[one_locs[0][idx]][one_locs[1][idx]])
             else:
-                feat_map_poly = [(predict_regr[one_locs[0][idx]][one_locs[1][idx]][0] / 4,
-                                  predict_regr[one_locs[0][idx]][one_locs[1][idx]][1] / 4),
-                                 (predict_regr[one_locs[0][idx]][one_locs[1][idx]][2] / 4,
-                                  predict_regr[one_locs[0][idx]][one_locs[1][idx]][3] / 4),
-                                 (predict_regr[one_locs[0][idx]][one_locs[1][idx]][4] / 4,
-                                  predict_regr[one_locs[0][idx]][one_locs[1][idx]][5] / 4),
-                                 (predict_regr[one_locs[0][idx]][one_locs[1][idx]][6] / 4,
-                                  predict_regr[one_locs[0][idx]][one_locs[1][idx]][7] / 4)]
-                acc_score = 0.0
-                num_score = 0
-                for ix in xrange(80):
-                    for jy in xrange(80):
-                        if point_check.point_in_polygon(ix, jy, feat_map_poly):
-                            num_score += 1
-                            acc_score += predict_cls[ix][jy]
-                score.append(acc_score / num_score)
+                feat_map_poly = [(predict_regr[one_locs[0][idx]][one_locs[1][idx]][0] / stride,
+                                  predict_regr[one_locs[0][idx]][one_locs[1][idx]][1] / stride),
+                                 (predict_regr[one_locs[0][idx]][one_locs[1][idx]][2] / stride,
+                                  predict_regr[one_locs[0][idx]][one_locs[1][idx]][3] / stride),
+                                 (predict_regr[one_locs[0][idx]][one_locs[1][idx]][4] / stride,
+                                  predict_regr[one_locs[0][idx]][one_locs[1][idx]][5] / stride),
+                                 (predict_regr[one_locs[0][idx]][one_locs[1][idx]][6] / stride,
+                                  predict_regr[one_locs[0][idx]][one_locs[1][idx]][7] / stride)]
+                # test all feature map pixels at once, pixel (ix, jy) is row ix * out_size + jy
+                in_poly = point_check.points_in_polygons(feat_map_points, [feat_map_poly])[0]
+                # a polygon covering no feature map pixel is scored 0 instead of nan, it is ranked last by nms
+                if not in_poly.any():
+                    score.append(0.0)
+                else:
+                    score.append(np.sum(predict_cls.ravel()[in_poly]) / np.sum(in_poly))
 
         # nms
         # dets store all predicted text region pixel's 8 corner coord and score
@@ -217,6 +235,12 @@ if __name__ == '__main__':
             idx_after_nms = nms.poly_nms(np.array(dets), thresh)
         else:
             print 'no predicted text region pixel on {0}'.format(img_data['imagePath'])
+        # decoded boxes (pixel coordinates + regression offsets) and pixels, scaled from the network input back to
+        # the image
+        ratio = np.tile(img_data['ratio'], 4)
+        boxes = (np.array(dets, dtype=np.float64).reshape(-1, 9)[:, 0:8] +
+                 np.tile(np.stack(coord, axis=-1), 4)) * ratio
+        img_coord = [coord[0] * ratio[0], coord[1] * ratio[1]]
 
         img = cv2.imread(img_data['imagePath'])
         img_draw = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
@@ -224,22 +248,16 @@ if __name__ == '__main__':
         use_nms = True
         if use_nms:
             for i in idx_after_nms:
-                draw.polygon([(dets[i][0] + coord[0][i], dets[i][1] + coord[1][i]),
-                              (dets[i][2] + coord[0][i], dets[i][3] + coord[1][i]),
-                              (dets[i][4] + coord[0][i], dets[i][5] + coord[1][i]),
-                              (dets[i][6] + coord[0][i], dets[i][7] + coord[1][i])], outline="blue")
+                draw.polygon([(boxes[i][0], boxes[i][1]), (boxes[i][2], boxes[i][3]),
+                              (boxes[i][4], boxes[i][5]), (boxes[i][6], boxes[i][7])], outline="blue")
         else:
             for i in xrange(len(one_locs[0])):
-                # draw predicted text region on raw image(320 * 320)
-                # use the coordinates on the raw image(320 * 320)
-                draw.text(([coord[0][i], coord[1][i]]), "O", "red")
+                # draw predicted text region on raw image
+                # use the coordinates on the raw image
+                draw.text(([img_coord[0][i], img_coord[1][i]]), "O", "red")
                 # draw regression parameters on iamge
-                top_left = [coord[0][i] + x1[i], coord[1][i] + y1[i]]
-                top_righ = [coord[0][i] + x2[i], coord[1][i] + y2[i]]
-                dow_righ = [coord[0][i] + x3[i], coord[1][i] + y3[i]]
-                dow_left = [coord[0][i] + x4[i], coord[1][i] + y4[i]]
-                draw.polygon([(top_left[0], top_left[1]), (top_righ[0], top_righ[1]),
-                              (dow_righ[0], dow_righ[1]), (dow_left[0], dow_left[1])], outline="black")
+                draw.polygon([(boxes[i][0], boxes[i][1]), (boxes[i][2], boxes[i][3]),
+                              (boxes[i][4], boxes[i][5]), (boxes[i][6], boxes[i][7])], outline="black")
 
         img_draw = np.array(img_draw)
         img_draw = cv2.cvtColor(img_draw, cv2.COLOR_RGB2BGR)
@@ -254,9 +272,9 @@ if __name__ == '__main__':
         img_cls = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
         draw = ImageDraw.Draw(img_cls)
         for i in xrange(len(one_locs[0])):
-            # draw predicted text region on raw image(320 * 320)
-            # use the coordinates on the raw image(320 * 320)
-            draw.text(([coord[0][i], coord[1][i]]), "O", "red")
+            # draw predicted text region on raw image
+            # use the coordinates on the raw image
+            draw.text(([img_coord[0][i], img_coord[1][i]]), "O", "red")
         img_cls = np.array(img_cls)
         img_cls = cv2.cvtColor(img_cls, cv2.COLOR_RGB2BGR)
 
@@ -29,7 +29,8 @@ from point_check import point_in_polygon
     2.1 generate classification output data
     2.2 (TODO) generate regression output data
 '''
-def get_train_data(all_imgs):
+def get_train_data(all_imgs, resized_cache=None):
+    # resized_cache, resized_cache.ResizedCache object, None means decoding at full size and resizing every time
     visulise = False
     while True:
         for img_data in all_imgs:      
@@ -42,13 +43,19 @@ def get_train_data(all_imgs):
             annot = strinfo.sub('txt',annot)
             
             if os.path.isfile(img_data['imagePath']) and os.path.isfile(annot):
-                img = cv2.imread(img_data['imagePath'])
-                width = img.shape[0] #2400
-                height = img.shape[1] #3200
-
                 ## 1)generate input data
                 ### 1.1)input image, from (2400,3200) to (320,320)
-                img_320 = cv2.resize(img,(320,320),interpolation=cv2.INTER_CUBIC)
+                if resized_cache is not None:
+                    # decoded at reduced scale on the first epoch, read from the cache on later epochs
+                    resized = resized_cache.read(img_data['imagePath'])
+                    if resized is None:
+                        continue
+                    img_320, (width, height) = resized
+                else:
+                    img = cv2.imread(img_data['imagePath'])
+                    width = img.shape[0] #2400
+                    height = img.shape[1] #3200
+                    img_320 = cv2.resize(img,(320,320),interpolation=cv2.INTER_CUBIC)
 
                 ## 2)generate output data
                 ### 2.1)generate classification output data
@@ -373,7 +380,10 @@ gpu_id = '0'
 os.environ['CUDA_VISIBLE_DEVICES']=str(gpu_id)
 
 all_imgs, numFileTxt = get_raw_data('/home/yuquanjie/Documents/icdar2017rctw_train_v1.2/train/part1')
-data_gen_train = get_train_data(all_imgs)
+# resized images are cached on disk, keyed by jpg content
+from resized_cache import ResizedCache
+resized_cache = ResizedCache('/home/yuquanjie/Documents/icdar2017rctw_train_v1.2/train/part1_resized_320')
+data_gen_train = get_train_data(all_imgs, resized_cache)
 #1) define Input
 img_input = Input((320,320,3))
 #2) define network
@@ -29,7 +29,8 @@ from point_check import point_in_polygon
     2.1 generate classification output data
     2.2 (TODO) generate regression output data
 '''
-def get_train_data(all_imgs):
+def get_train_data(all_imgs, resized_cache=None):
+    # resized_cache, resized_cache.ResizedCache object, None means decoding at full size and resizing every time
     visulise = False
     while True:
         for img_data in all_imgs:      
@@ -42,13 +43,19 @@ def get_train_data(all_imgs):
             annot = strinfo.sub('txt',annot)
             
             if os.path.isfile(img_data['imagePath']) and os.path.isfile(annot):
-                img = cv2.imread(img_data['imagePath'])
-                width = img.shape[0] #2400
-                height = img.shape[1] #3200
-
                 ## 1)generate input data
                 ### 1.1)input image, from (2400,3200) to (320,320)
-                img_320 = cv2.resize(img,(320,320),interpolation=cv2.INTER_CUBIC)
+                if resized_cache is not None:
+                    # decoded at reduced scale on the first epoch, read from the cache on later epochs
+                    resized = resized_cache.read(img_data['imagePath'])
+                    if resized is None:
+                        continue
+                    img_320, (width, height) = resized
+                else:
+                    img = cv2.imread(img_data['imagePath'])
+                    width = img.shape[0] #2400
+                    height = img.shape[1] #3200
+                    img_320 = cv2.resize(img,(320,320),interpolation=cv2.INTER_CUBIC)
 
                 ## 2)generate output data
                 ### 2.1)generate classification output data
@@ -289,7 +296,6 @@ from PIL import Image, ImageFont, ImageDraw
 from keras.layers import Input
 from keras.models import Model
 import sys
-import h5py
 sys.path.append('/home/yuquanjie/Documents/deep-direct-regression/tools')
 from point_check import point_in_polygon
 from get_data import get_raw_data
@@ -304,24 +310,17 @@ regr = regression_net(img_input,trainable=True)
 regr_model = Model(img_input,regr)
 # Compile model
 regr_model.compile(loss=smoothL1, optimizer='sgd')
-# Read train data from file
-file = h5py.File('../dataset/train_dataset-1500.h5','r')
-X_train = file['X_train'][:]
-Y_train = file['Y_train_merge'][:]
-print 'train data shape'
-print X_train.shape
-print Y_train.shape
-file.close()
-# Read train data from file
-file = h5py.File('../dataset/val_dataset-1000.h5','r')
-print 'validation data shape'
-X_val = file['X_train'][:]
-Y_val = file['Y_train_merge'][:]
-print X_val.shape
-print Y_val.shape
-file.close()
+# Read train data from file, batch by batch in chunk-aligned shuffled order
+from h5_dataset import ChunkShuffleReader
+train_reader = ChunkShuffleReader('../dataset/train_dataset-1500.h5', ('X_train', 'Y_train_merge'), batch_size=20)
+print 'train data, {0} samples'.format(train_reader.num_rows)
+# Read validation data from file
+val_reader = ChunkShuffleReader('../dataset/val_dataset-1000.h5', ('X_train', 'Y_train_merge'), batch_size=20)
+print 'validation data, {0} samples'.format(val_reader.num_rows)
 # Fit model
 filepath = "model-regr/loss-decrease-{epoch:02d}-{loss:.2f}.hdf5"
 checkpoint = ModelCheckpoint(filepath, monitor = 'loss', verbose = 1, save_best_only = True, mode='min')
 callbacks_list = [checkpoint]
-loss_class = regr_model.fit(X_train, Y_train, batch_size=20, epochs=5000, validation_data=(X_val,Y_val), callbacks = callbacks_list, verbose=1)
+loss_class = regr_model.fit_generator(train_reader.batches(), steps_per_epoch=len(train_reader), epochs=5000,
+                                      validation_data=val_reader.batches(), validation_steps=len(val_reader),
+                                      callbacks = callbacks_list, verbose=1)
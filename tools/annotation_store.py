@@ -0,0 +1,371 @@
+import os
+import sys
+import numpy as np
+import cv2
+import tools.manifest as manifest
+
+# suffix of the store file saved next to a image directory, see load_or_build
+STORE_SUFFIX = '.annotations.bin'
+# first bytes of a store file, followed by the arrays in npy format
+MAGIC = 'ANNOSTORE2\n'
+# stores written before the file stats were saved, rebuilt from scratch
+MAGIC_V1 = 'ANNOSTORE1\n'
+# BOM written by some annotation tools at the beginning of txt files
+UTF8_BOM = '\xef\xbb\xbf'
+# suffix of the split lists written by tools.split_dataset, one jpg path per line
+SPLIT_SUFFIX = '.txt'
+
+
+def parse_txtreg_files(txt_paths, dtype=np.float32):
+    """
+    bulk parser, read the text regions of many txt files, all coordinates are converted to float in one call
+    each line of a txt file is x1,y1,x2,y2,x3,y3,x4,y4[,...], fields after the 8th (e.g. transcription) are ignored
+    :param txt_paths: list of txt file path
+    :param dtype: dtype of coords, np.float32 for the store, np.float64 keeps non-integer annotations exact
+    :return: A tuple (coords, offsets)
+             coords numpy array of dtype, shape (total number of boxes, 8)
+             offsets int64 numpy array, shape (len(txt_paths) + 1, ),
+             boxes of file i are coords[offsets[i]:offsets[i + 1]]
+    """
+    fields = []
+    offsets = np.zeros(len(txt_paths) + 1, dtype=np.int64)
+    for idx, txt_path in enumerate(txt_paths):
+        with open(txt_path, 'r') as f:
+            text = f.read()
+        if text.startswith(UTF8_BOM):
+            text = text[len(UTF8_BOM):]
+        num_box = 0
+        for line in text.splitlines():
+            line_split = line.strip().split(',', 8)
+            # skip empty lines
+            if len(line_split) < 8:
+                if line.strip():
+                    raise ValueError('{0}: line "{1}" has less than 8 coordinates'.format(txt_path, line.strip()))
+                continue
+            fields.append(','.join(line_split[0:8]))
+            num_box += 1
+        offsets[idx + 1] = offsets[idx] + num_box
+    if not fields:
+        return np.zeros((0, 8), dtype=dtype), offsets
+    coords = np.fromstring(','.join(fields), dtype=np.float64, sep=',')
+    if coords.size != 8 * offsets[-1]:
+        raise ValueError('unparsable coordinates in {0} txt files'.format(len(txt_paths)))
+    return coords.astype(dtype, copy=False).reshape(-1, 8), offsets
+
+
+def _write_array(f, array):
+    np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+
+def _memmap_array(f, path, mmap):
+    """
+    read the header of the npy format array at the current position of f, then map (or read) the array data
+    """
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    offset = f.tell()
+    count = int(np.prod(shape))
+    if count == 0:
+        array = np.zeros(shape, dtype=dtype)
+    elif mmap:
+        array = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    else:
+        array = np.fromfile(f, dtype=dtype, count=count).reshape(shape)
+    # move to the next array
+    f.seek(offset + count * dtype.itemsize)
+    return array
+
+
+class AnnotationStore(object):
+    """
+    columnar text region store of a image set
+    all boxes are in one float32 array, image i's boxes are coords[offsets[i]:offsets[i + 1]],
+    image paths are in one byte array, image i's path is path_bytes[path_offsets[i]:path_offsets[i + 1]]
+    saved as a single file, the arrays are memory-mapped when loading, so worker processes share the pages
+    the jpg and txt file sizes and mtimes of each image are saved too, rebuilding only parses the changed txt files
+    """
+    def __init__(self, path_bytes, path_offsets, coords, offsets, stats=None):
+        """
+        :param path_bytes: uint8 numpy array, all jpg paths concatenated
+        :param path_offsets: int64 numpy array, shape (num_images + 1, )
+        :param coords: float32 numpy array, shape (num_boxes, 8)
+        :param offsets: int64 numpy array, shape (num_images + 1, )
+        :param stats: float64 numpy array (num_images, 4), jpg size, jpg mtime, txt size, txt mtime when the txt file
+                      was parsed, see manifest.Manifest, None means unknown
+        """
+        self.path_bytes = path_bytes
+        self.path_offsets = path_offsets
+        self.coords = coords
+        self.offsets = offsets
+        self.stats = stats
+        self._path_index = None
+
+    @classmethod
+    def from_files(cls, jpg_paths, txt_paths=None, stats=None):
+        """
+        build a store by parsing txt files
+        :param jpg_paths: list of jpg file path
+        :param txt_paths: list of txt file path, None means jpg path with .txt extension
+        :param stats: float64 numpy array (len(jpg_paths), 4), file sizes and mtimes, None means unknown
+        :return: AnnotationStore object
+        """
+        if txt_paths is None:
+            txt_paths = [os.path.splitext(jpg_path)[0] + '.txt' for jpg_path in jpg_paths]
+        coords, offsets = parse_txtreg_files(txt_paths)
+        return cls.from_arrays(jpg_paths, coords, offsets, stats)
+
+    @classmethod
+    def from_arrays(cls, jpg_paths, coords, offsets, stats=None):
+        """
+        :param jpg_paths: list of jpg file path
+        :param coords: float32 numpy array, shape (num_boxes, 8)
+        :param offsets: int64 numpy array, shape (len(jpg_paths) + 1, )
+        :param stats: float64 numpy array (len(jpg_paths), 4), file sizes and mtimes, None means unknown
+        :return: AnnotationStore object
+        """
+        encoded = [jpg_path.encode('utf-8') if isinstance(jpg_path, unicode) else jpg_path for jpg_path in jpg_paths]
+        path_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        path_offsets[1:] = np.cumsum([len(jpg_path) for jpg_path in encoded])
+        path_bytes = np.frombuffer(''.join(encoded), dtype=np.uint8)
+        return cls(path_bytes, path_offsets, coords, offsets, stats)
+
+    @classmethod
+    def from_manifest(cls, image_manifest, valid_paths=None, old_store=None):
+        """
+        build a store of all non-empty jpg files of a manifest
+        :param image_manifest: manifest.Manifest object
+        :param valid_paths: list of valid jpg file path written by tools.check_dataset, None means all jpg files,
+                            files of the manifest not in the list are left out
+        :param old_store: AnnotationStore object built before, the text regions of it's images whose jpg and txt
+                          files have the same sizes and mtimes are reused, only the other txt files are parsed
+        :return: AnnotationStore object
+        """
+        jpg_paths, txt_paths = image_manifest.jpg_paths(), image_manifest.txt_paths()
+        stats = image_manifest.pair_stats()
+        if valid_paths is not None:
+            valid_paths = set(valid_paths)
+            keep = [idx for idx, jpg_path in enumerate(jpg_paths) if jpg_path in valid_paths]
+            jpg_paths, txt_paths = [jpg_paths[idx] for idx in keep], [txt_paths[idx] for idx in keep]
+            stats = stats[keep]
+        if old_store is None or old_store.stats is None:
+            return cls.from_files(jpg_paths, txt_paths, stats)
+        old_rows = np.full(len(jpg_paths), -1, dtype=np.int64)
+        for idx, jpg_path in enumerate(jpg_paths):
+            try:
+                old_idx = old_store.index(jpg_path)
+            except KeyError:
+                continue
+            if np.array_equal(old_store.stats[old_idx], stats[idx]):
+                old_rows[idx] = old_idx
+        reused, parsed = np.nonzero(old_rows >= 0)[0], np.nonzero(old_rows < 0)[0]
+        parsed_coords, parsed_offsets = parse_txtreg_files([txt_paths[idx] for idx in parsed])
+        counts = np.zeros(len(jpg_paths), dtype=np.int64)
+        counts[reused] = np.diff(old_store.offsets)[old_rows[reused]]
+        counts[parsed] = np.diff(parsed_offsets)
+        offsets = np.zeros(len(jpg_paths) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        coords = np.zeros((offsets[-1], 8), dtype=np.float32)
+        coords[_box_rows(offsets[reused], counts[reused])] = \
+            old_store.coords[_box_rows(old_store.offsets[old_rows[reused]], counts[reused])]
+        coords[_box_rows(offsets[parsed], counts[parsed])] = parsed_coords
+        if len(parsed):
+            print 'parsed {0} new or changed txt files of {1}'.format(len(parsed), len(jpg_paths))
+        return cls.from_arrays(jpg_paths, coords, offsets, stats)
+
+    def save(self, store_path):
+        """
+        write the store into one file, written to a temporary file and renamed into place
+        :param store_path: store file path
+        """
+        tmp_path = '{0}.{1}.tmp'.format(store_path, os.getpid())
+        # unknown stats never match a file, those images are parsed again when the store is rebuilt
+        stats = self.stats if self.stats is not None else np.full((len(self), 4), np.nan)
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            for array in (self.path_bytes, self.path_offsets, self.coords, self.offsets, stats):
+                _write_array(f, array)
+        os.rename(tmp_path, store_path)
+
+    @classmethod
+    def load(cls, store_path, mmap=True):
+        """
+        :param store_path: store file path
+        :param mmap: memory-map the arrays instead of reading them into memory
+        :return: AnnotationStore object
+        """
+        with open(store_path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic not in (MAGIC, MAGIC_V1):
+                raise ValueError('{0} is not a annotation store file'.format(store_path))
+            arrays = [_memmap_array(f, store_path, mmap) for _ in xrange(5 if magic == MAGIC else 4)]
+        return cls(*arrays)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def path(self, idx):
+        """
+        :param idx: image index
+        :return: jpg file path
+        """
+        return self.path_bytes[self.path_offsets[idx]:self.path_offsets[idx + 1]].tostring()
+
+    def paths(self):
+        """
+        :return: list of all jpg file path
+        """
+        return [self.path(idx) for idx in xrange(len(self))]
+
+    def txt_path(self, idx):
+        """
+        :param idx: image index
+        :return: txt file path
+        """
+        return os.path.splitext(self.path(idx))[0] + '.txt'
+
+    def txtreg(self, idx):
+        """
+        :param idx: image index
+        :return: float32 numpy array, shape (number of boxes, 8), each row is [x1, y1, x2, y2, x3, y3, x4, y4]
+        """
+        return self.coords[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def read_image(self, idx):
+        """
+        :param idx: image index
+        :return: decoded image, None if the jpg file is not readable
+        """
+        return cv2.imread(self.path(idx))
+
+    def labels(self, idx, geom):
+        """
+        the store has no precomputed targets, see shard.ShardReader.labels
+        :return: None
+        """
+        return None
+
+    def num_boxes(self, idx=None):
+        """
+        :param idx: image index, None means all images
+        :return: number of boxes of image idx, numpy array of all images' box numbers if idx is None
+        """
+        if idx is None:
+            return np.diff(self.offsets)
+        return int(self.offsets[idx + 1] - self.offsets[idx])
+
+    def index(self, jpg_path):
+        """
+        :param jpg_path: jpg file path
+        :return: image index, KeyError if the image is not in the store
+        """
+        if self._path_index is None:
+            self._path_index = dict((path, idx) for idx, path in enumerate(self.paths()))
+        return self._path_index[jpg_path]
+
+    def select(self, indices):
+        """
+        a store of some images, the text regions are copied from this store, no txt file is parsed
+        :param indices: image indices, in the order of the new store
+        :return: AnnotationStore object
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = np.diff(self.offsets)[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        rows = _box_rows(self.offsets[indices], counts)
+        return AnnotationStore.from_arrays([self.path(idx) for idx in indices], np.array(self.coords[rows]), offsets,
+                                           self.stats[indices] if self.stats is not None else None)
+
+
+def _box_rows(starts, counts):
+    """
+    :param starts: int64 numpy array, first box row of each image
+    :param counts: int64 numpy array, number of boxes of each image
+    :return: int64 numpy array, box rows of image i are starts[i], starts[i] + 1, ..., starts[i] + counts[i] - 1,
+             concatenated
+    """
+    starts, counts = np.asarray(starts, dtype=np.int64), np.asarray(counts, dtype=np.int64)
+    ends = np.cumsum(counts)
+    return np.arange(ends[-1] if len(ends) else 0, dtype=np.int64) + np.repeat(starts - (ends - counts), counts)
+
+
+def load_or_build(directory, store_path=None):
+    """
+    load the store of a image directory, (re)build and save it if it does not exist or the directory's manifest or
+    list of valid samples is changed
+    only the valid samples are in the store if the directory is checked by tools.check_dataset
+    :param directory: directory of jpg and txt files
+    :param store_path: store file path, None means directory + STORE_SUFFIX, next to the directory
+    :return: AnnotationStore object
+    """
+    store_path = store_path or os.path.normpath(directory) + STORE_SUFFIX
+    # the manifest file is rewritten only when the directory or a file of it is changed
+    image_manifest = manifest.load_or_build(directory)
+    depends = [manifest.default_path(directory)]
+    valid_path = manifest.valid_list_path(directory)
+    if os.path.isfile(valid_path):
+        if os.path.getmtime(valid_path) < os.path.getmtime(depends[0]):
+            print '{0} is older than the directory, new samples are left out until it is checked ' \
+                  'again'.format(valid_path)
+        depends.append(valid_path)
+    old_store = None
+    if os.path.isfile(store_path):
+        try:
+            old_store = AnnotationStore.load(store_path)
+        except (IOError, ValueError):
+            old_store = None
+        if old_store is not None and all(os.path.getmtime(store_path) >= os.path.getmtime(path) for path in depends):
+            return old_store
+    valid_paths = manifest.load_valid_list(valid_path) if len(depends) > 1 else None
+    # only the txt files changed since the old store are parsed
+    AnnotationStore.from_manifest(image_manifest, valid_paths, old_store).save(store_path)
+    return AnnotationStore.load(store_path)
+
+
+def load_split(list_path):
+    """
+    load the images of a split list written by tools.split_dataset, the text regions are taken from the stores of
+    the images' directories, so loading a split does not parse txt files
+    images not in their directory's store (e.g. rejected by tools.check_dataset after splitting) are left out
+    :param list_path: split list file path, one jpg path per line
+    :return: AnnotationStore object, images in the order of the list
+    """
+    jpg_paths = manifest.load_valid_list(list_path)
+    stores, rows = {}, []
+    for jpg_path in jpg_paths:
+        directory = os.path.dirname(jpg_path)
+        if directory not in stores:
+            stores[directory] = load_or_build(directory)
+        try:
+            rows.append((directory, stores[directory].index(jpg_path)))
+        except KeyError:
+            continue
+    if len(rows) < len(jpg_paths):
+        print '{0} images of {1} are not in their directory, left out'.format(len(jpg_paths) - len(rows), list_path)
+    if len(stores) == 1:
+        # common case, all images from one directory, the boxes are copied at once
+        return stores.values()[0].select([idx for _, idx in rows])
+    txtregs = [stores[directory].txtreg(idx) for directory, idx in rows]
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(txtreg) for txtreg in txtregs])
+    return AnnotationStore.from_arrays([stores[directory].path(idx) for directory, idx in rows],
+                                       np.concatenate(txtregs or [np.zeros((0, 8), dtype=np.float32)]), offsets)
+
+
+def load_images(path):
+    """
+    :param path: directory of jpg and txt files, or split list file written by tools.split_dataset
+    :return: AnnotationStore object, see load_or_build and load_split
+    """
+    if os.path.isfile(path) and path.endswith(SPLIT_SUFFIX):
+        return load_split(path)
+    return load_or_build(path)
+
+
+if __name__ == '__main__':
+    # python -m tools.annotation_store image_dir [store_path]
+    store = load_or_build(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print '{0} images, {1} boxes'.format(len(store), len(store.coords))
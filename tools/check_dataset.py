@@ -0,0 +1,71 @@
+import os
+import sys
+import multiprocessing
+from collections import Counter
+import tools.manifest as manifest
+import tools.annotation_store as annotation_store
+import tools.resized_cache as resized_cache
+
+
+def check_sample(args):
+    """
+    check one jpg and txt pair without decoding the image
+    :param args: A tuple (jpg path, txt path, crop size or None, minimum number of boxes)
+    :return: reason of rejecting the sample, None if the sample is valid
+    """
+    jpg_path, txt_path, crop_size, min_boxes = args
+    if not os.path.isfile(txt_path):
+        return 'no txt file'
+    try:
+        img_size = resized_cache.read_jpeg_size(jpg_path)
+    except (IOError, OSError):
+        return 'unreadable jpg'
+    if img_size is None:
+        return 'not a jpeg'
+    if crop_size is not None and img_size != (crop_size, crop_size):
+        return 'not {0} * {0}'.format(crop_size)
+    try:
+        _, offsets = annotation_store.parse_txtreg_files([txt_path])
+    except (IOError, ValueError):
+        return 'unparsable txt'
+    if offsets[-1] < min_boxes:
+        return 'too few boxes (< {0})'.format(min_boxes)
+    return None
+
+
+def check_directory(directory, crop_size=320, min_boxes=1, processes=None):
+    """
+    check all jpg files of a directory in parallel, see check_sample
+    :param directory: directory of jpg and txt files
+    :param crop_size: cropped image size, None means any size
+    :param min_boxes: minimum number of text regions of a valid sample
+    :param processes: number of worker processes, None means the number of cpus
+    :return: A tuple (valid jpg paths, collections.Counter of rejecting reasons)
+    """
+    image_manifest = manifest.load_or_build(directory)
+    jpg_paths = image_manifest.jpg_paths(non_empty=False)
+    tasks = [(jpg_path, os.path.splitext(jpg_path)[0] + '.txt', crop_size, min_boxes) for jpg_path in jpg_paths]
+    pool = multiprocessing.Pool(processes)
+    try:
+        reasons = pool.map(check_sample, tasks, chunksize=256)
+    finally:
+        pool.close()
+        pool.join()
+    # jpg files without txt file are not in the manifest
+    num_jpgs = sum(1 for file_name in os.listdir(directory) if os.path.splitext(file_name)[1] == '.jpg')
+    rejected = Counter(reason for reason in reasons if reason is not None)
+    if num_jpgs > len(jpg_paths):
+        rejected['no txt file'] += num_jpgs - len(jpg_paths)
+    return [jpg_path for jpg_path, reason in zip(jpg_paths, reasons) if reason is None], rejected
+
+
+if __name__ == '__main__':
+    # python -m tools.check_dataset image_dir [crop_size, 0 means any size] [min_boxes] [processes]
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 320
+    valid_paths, rejected = check_directory(sys.argv[1], size or None, int(sys.argv[3]) if len(sys.argv) > 3 else 1,
+                                            int(sys.argv[4]) if len(sys.argv) > 4 else None)
+    for reason, count in rejected.most_common():
+        print '\t{0}: {1}'.format(reason, count)
+    manifest.save_valid_list(valid_paths, manifest.valid_list_path(sys.argv[1]))
+    print '{0} valid samples, {1} rejected, saved in {2}'.format(len(valid_paths), sum(rejected.values()),
+                                                                 manifest.valid_list_path(sys.argv[1]))
@@ -14,7 +14,8 @@ def heatmap_cls(ndarray, img_data, img_cls, img_reg, fig_name):
     ax1 = plt.subplot(221)
     ax1.title.set_text('heatmap')
     x, y = [], []
-    for i in xrange(1, 81):
+    # feature map is square, out_size * out_size
+    for i in xrange(1, ndarray.shape[0] + 1):
         x.append(i)
         y.append(i)
     intensity = np.rot90(ndarray, 1).tolist()
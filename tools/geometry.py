@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class Geometry(object):
+    """
+    input size, output stride and output feature map size shared by the label generators, the network and the
+    predictor, with precomputed coordinate grids of the output feature map
+    """
+    # the network pools the input 6 times, input size should be divisible by 2 ** 6
+    input_multiple = 64
+
+    def __init__(self, input_size=320, stride=4):
+        """
+        :param input_size: network input image size, input is input_size * input_size * 3
+        :param stride: input image size / output feature map size, 4, 8 or 16
+        """
+        if input_size % self.input_multiple != 0:
+            raise ValueError('input size {0} is not divisible by {1}'.format(input_size, self.input_multiple))
+        if stride not in (4, 8, 16):
+            raise ValueError('stride {0} is not one of 4, 8, 16'.format(stride))
+        self.input_size = input_size
+        self.stride = stride
+        self.out_size = input_size // stride
+        # feature map pixel (ix, jy) is row ix * out_size + jy, ix is x-axis
+        ix, jy = np.meshgrid(np.arange(self.out_size), np.arange(self.out_size), indexing='ij')
+        self.grid_points = np.stack((ix.ravel(), jy.ravel()), axis=-1).astype(np.float64)
+        # feature map pixel's coordinates on the input image
+        self.grid_x = ix * stride
+        self.grid_y = jy * stride
+
+    def __repr__(self):
+        return 'Geometry(input_size={0}, stride={1})'.format(self.input_size, self.stride)
+
+
+GEOMETRIES = {
+    # 320 input, 80 * 80 output
+    'default': Geometry(320, 4),
+    # fast cpu tier, 192 input, 48 * 48 output
+    'fast': Geometry(192, 4),
+    # 40 * 40 output, 4x fewer post-processing candidates
+    'stride8': Geometry(320, 8),
+}
+DEFAULT = GEOMETRIES['default']
+
+
+def get_geometry(name):
+    """
+    :param name: key of GEOMETRIES
+    :return: Geometry object
+    """
+    if name not in GEOMETRIES:
+        raise ValueError('unknown geometry {0}, should be one of {1}'.format(name, sorted(GEOMETRIES.keys())))
+    return GEOMETRIES[name]
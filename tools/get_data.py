@@ -3,10 +3,12 @@ import string
 import sys
 import numpy as np
 import cv2
-import re
 import glob
 import h5py
-import tools.point_check as point_check
+import tools.label_engine as label_engine
+import tools.annotation_store as annotation_store
+import tools.manifest as manifest
+import tools.split_dataset as split_dataset
 from PIL import Image, ImageDraw, ImageFont
 fnt = ImageFont.truetype('/home/yuquanjie/Download/FreeMono.ttf', size=35)
 
@@ -37,45 +39,12 @@ def get_zone(text_reg):
     """
     split text region to get positive zone and gray zone(not care region)
     should judge quardrange's short side
+    list version of label_engine.get_zone_array
     :param text_reg:
     :return: A tuple (gray_zone, posi_zone)
     """
-    posi_zone = []
-    gray_zone = []
-    for txt in text_reg:
-        x1, y1, x2, y2 = txt[0], txt[1], txt[2], txt[3]
-        x3, y3, x4, y4 = txt[4], txt[5], txt[6], txt[7]
-        line_1_2_len = np.sqrt(np.square(x1 - x2) + np.square(y1 - y2))
-        line_1_4_len = np.sqrt(np.square(x1 - x4) + np.square(y1 - y4))
-        if line_1_2_len <= line_1_4_len:
-            # short side is line_1_2
-            mid_point_1_2 = [(x1 + x2) / 2, (y1 + y2) / 2]
-            mid_point_m_1 = [(x1 + mid_point_1_2[0]) / 2, (y1 + mid_point_1_2[1]) / 2]
-            mid_point_m_2 = [(x2 + mid_point_1_2[0]) / 2, (y2 + mid_point_1_2[1]) / 2]
-
-            mid_point_3_4 = [(x3 + x4) / 2, (y3 + y4) / 2]
-            mid_point_m_3 = [(x3 + mid_point_3_4[0]) / 2, (y3 + mid_point_3_4[1]) / 2]
-            mid_point_m_4 = [(x4 + mid_point_3_4[0]) / 2, (y4 + mid_point_3_4[1]) / 2]
-
-            gray_zone.append([x1, y1, mid_point_m_1[0], mid_point_m_1[1], mid_point_m_4[0], mid_point_m_4[1], x4, y4])
-            gray_zone.append([mid_point_m_2[0], mid_point_m_2[1], x2, y2, x3, y3, mid_point_m_3[0], mid_point_m_3[1]])
-            posi_zone.append([mid_point_m_1[0], mid_point_m_1[1], mid_point_m_2[0], mid_point_m_2[1],
-                              mid_point_m_3[0], mid_point_m_3[1], mid_point_m_4[0], mid_point_m_4[1]])
-        else:
-            # short side is line_1_4
-            mid_point_1_4 = [(x1 + x4) / 2, (y1 + y4) / 2]
-            mid_point_m_1 = [(x1 + mid_point_1_4[0]) / 2, (y1 + mid_point_1_4[1]) / 2]
-            mid_point_m_4 = [(x4 + mid_point_1_4[0]) / 2, (y4 + mid_point_1_4[1]) / 2]
-
-            mid_point_2_3 = [(x2 + x3) / 2, (y2 + y3) / 2]
-            mid_point_m_2 = [(x2 + mid_point_2_3[0]) / 2, (y2 + mid_point_2_3[1]) / 2]
-            mid_point_m_3 = [(x3 + mid_point_2_3[0]) / 2, (y3 + mid_point_2_3[1]) / 2]
-            gray_zone.append([x1, y1, x2, y2, mid_point_m_2[0], mid_point_m_2[1], mid_point_m_1[0], mid_point_m_1[1]])
-            gray_zone.append([mid_point_m_4[0], mid_point_m_4[1], mid_point_m_3[0], mid_point_m_3[1], x3, y3, x4, y4])
-            posi_zone.append([mid_point_m_1[0], mid_point_m_1[1], mid_point_m_2[0], mid_point_m_2[1],
-                              mid_point_m_3[0], mid_point_m_3[1], mid_point_m_4[0], mid_point_m_4[1]])
-
-    return gray_zone, posi_zone
+    gray_zone, posi_zone = label_engine.get_zone_array(text_reg)
+    return gray_zone.tolist(), posi_zone.tolist()
 
 
 def test_get_zone():
@@ -159,230 +128,142 @@ def get_raw_data(input_path, save_gt=False):
     :param save_gt: save gt in result/ directory
     :return: 1) a list, each element is a dictionary
              'imagePath'
-             'boxCoord'
+             'boxCoord', float64 numpy array (boxNum, 8), a view of annotation_store.parse_txtreg_files's result,
+                         float64 like the parsed txt values, the croppers write them out again
              'boxNum'
-             2) number of the txt that have processed
+             2) number of the jpg and txt pairs that have processed
     """
     # define variable for returning
     all_txts = []  # a list, each element is a dictionary
-    coords = []  # a list, storing a image's all text region's coordinates which is clockwise
-    num_txt = 0
     visual = False
     print('Parsing txt files')
-    # txt_directory = os.path.join(input_path, 'text')
-    # all_txt_files = [os.path.join(txt_directory, s) for s in os.listdir(txt_directory)]
-    txtfiles = input_path + '/*.txt'
-    all_txt_files = glob.glob(txtfiles)
-    box_num = 0
-    for txt in all_txt_files:
-        with open(txt, 'r') as f:
-            num_txt += 1
-            for line in f:
-                box_num += 1
-                line_split = line.strip().split(',')
-                # clockwise
-                (x1, y1, x2, y2) = line_split[0:4]
-                (x3, y3, x4, y4) = line_split[4:8]
-                coords.append((x1, y1, x2, y2, x3, y3, x4, y4))
-            txtfilepath = txt
-            # using regular expression, get image file path
-            # pattern = re.compile('text')
-            # img_file_path = pattern.sub('image', txt)
-            pattern = re.compile('txt')
-            img_file_path = pattern.sub('jpg', txtfilepath)
-            txt_data = {'imagePath': img_file_path, 'boxCoord': coords, 'boxNum': box_num}
-            box_num = 0
-            coords = []
-            # image file wheater corresponding to text file, and image file is not empty then add
-            if os.path.isfile(img_file_path) and os.path.isfile(txtfilepath) \
-                    and os.path.getsize(img_file_path):
-                all_txts.append(txt_data)
+    # jpg and txt pairs with non-empty jpg file, only rescanned when the directory is changed
+    image_manifest = manifest.load_or_build(input_path)
+    all_jpg_files, all_txt_files = image_manifest.jpg_paths(), image_manifest.txt_paths()
+    # parse all txt files at once, image i's text regions are coords[offsets[i]:offsets[i + 1]]
+    coords, offsets = annotation_store.parse_txtreg_files(all_txt_files, np.float64)
+    for idx, img_file_path in enumerate(all_jpg_files):
+        txt_data = {'imagePath': img_file_path, 'boxCoord': coords[offsets[idx]:offsets[idx + 1]],
+                    'boxNum': int(offsets[idx + 1] - offsets[idx])}
+        all_txts.append(txt_data)
+        # -----------------------visualizing-----------------------------------------
+        # draw text region on image and save image
+        # print text region on image for comparing gt and predicted results
+        if save_gt:
+            save_groudtruth(cv2.imread(img_file_path), txt_data['boxCoord'], img_file_path)
+
+        # draw text region on image and show image
+        if visual:
+            visualize(cv2.imread(img_file_path), txt_data['boxCoord'], img_file_path)
             # -----------------------visualizing-----------------------------------------
-            # draw text region on image and save image
-            # print text region on image for comparing gt and predicted results
-            if os.path.isfile(img_file_path) and os.path.isfile(txtfilepath) \
-                    and os.path.getsize(img_file_path) and save_gt:
-                save_groudtruth(cv2.imread(img_file_path), txt_data['boxCoord'], img_file_path)
-
-            # draw text region on image and show image
-            if os.path.isfile(img_file_path) and os.path.isfile(txtfilepath) \
-                    and os.path.getsize(img_file_path) and visual:
-                visualize(cv2.imread(img_file_path), txt_data['boxCoord'], img_file_path)
-                # -----------------------visualizing-----------------------------------------
-    return all_txts, num_txt
+    return all_txts, len(image_manifest)
 
 
-def image_generator_not_random(list_of_files, crop_size=320, scale=1):
+def image_generator_not_random(store, crop_size=320, scale=1):
     """
-    a python generator, traversal all txt files and jpg files
-    :param list_of_files: list, storing all jpg file path
+    a python generator, traversal all images of a annotation store
+    :param store: annotation_store.AnnotationStore object
     :param crop_size: cropped image size
     :param scale: normalization parameters
-    :return: A list [numpy array, text region list]
+    :return: A list [numpy array, text region numpy array (N, 8)]
     """
     while True:
-        text_region = []
-        for jpgname in list_of_files:
+        for idx in xrange(len(store)):
+            jpgname = store.path(idx)
             print jpgname
-            # jpgname = np.random.choice(list_of_files)
-            img = cv2.imread(jpgname)
-            pattern = re.compile('jpg')
-            txtname = pattern.sub('txt', jpgname)
-            if not os.path.isfile(txtname):
+            text_region = store.txtreg(idx)
+            # checked before decoding, tools.check_dataset removes such samples up front
+            if len(text_region) == 0:
                 continue
-            cropped_image = img
-            with open(txtname, 'r') as f:
-                for line in f:
-                    line_split = line.strip().split(',')
-                    print line_split
-                    # clockwise
-                    (x1, y1, x2, y2) = line_split[0:4]
-                    (x3, y3, x4, y4) = line_split[4:8]
-                    text_region.append([string.atof(x1), string.atof(y1), string.atof(x2), string.atof(y2),
-                                        string.atof(x3), string.atof(y3), string.atof(x4), string.atof(y4)])
-            if cropped_image is None or text_region is None or \
-                    cropped_image.shape[0] != crop_size or cropped_image.shape[1] != crop_size:
+            cropped_image = cv2.imread(jpgname)
+            if cropped_image is None or cropped_image.shape[0] != crop_size or cropped_image.shape[1] != crop_size:
                 continue
-            yield [scale * cropped_image, text_region]
+            yield [np.multiply(cropped_image, scale, dtype=np.float32), text_region]
 
 
-def image_output_pair(path, scale):
+def image_output_pair(path, scale=None, crop_size=320):
     """
 
-    :param path:
-    :param scale:
+    :param path: directory of jpg and txt files, or split list written by tools.split_dataset
+    :param scale: normalization parameter, None means yielding the raw uint8 image
+    :param crop_size: cropped image size, images of other size are skipped
     :return:
     """
-    all_images, num = get_raw_data(path)
-    # print len(all_images)
-    # for img, txtreg in images:
-    for image in all_images:
-        # print image['imagePath']
-        img = cv2.imread(image['imagePath'])
-        # 0) according to image path generate text_region is a list which element is aslo a list whose elemnt is a float
-        txtreg = []
-        patt = re.compile('jpg')
-        txtpath = patt.sub('txt', image['imagePath'])
-        with open(txtpath, 'r') as f:
-            for line in f:
-                line_split = line.strip().split(',')
-                # print line_split
-                # clockwise
-                (x1, y1, x2, y2) = line_split[0:4]
-                (x3, y3, x4, y4) = line_split[4:8]
-                txtreg.append([string.atof(x1), string.atof(y1), string.atof(x2), string.atof(y2),
-                               string.atof(x3), string.atof(y3), string.atof(x4), string.atof(y4)])
+    # text regions are parsed once and saved next to the directory, see annotation_store.load_images
+    store = annotation_store.load_images(path)
+    for idx in xrange(len(store)):
+        img = cv2.imread(store.path(idx))
+        if img is None or img.shape[0] != crop_size or img.shape[1] != crop_size:
+            print 'skip {0}'.format(store.path(idx))
+            continue
+        # 0) the image's text region, numpy array (N, 8), float32 like the generators' and the label cache's
+        txtreg = store.txtreg(idx)
         # 1) generate imput data, input data is (320, 320, 3)
-        # img *= scale
-        # 2) generate clsssification data
-        # split text region into gray_zone and posi_zone
-        gray_zone, posi_zone = get_zone(txtreg)
-        # x-axis and y-axis reduced scale
-        reduced_x, reduced_y = float(img.shape[1]) / 80.0, float(img.shape[0]) / 80.0
-        mask_label = np.ones((80, 80))
-        # y_class_label = -1 * np.ones((80, 80))  # negative lable is -1
-        y_class_label = np.zeros((80, 80))  # negative lable is 0
-        for ix in xrange(y_class_label.shape[0]):
-            for jy in xrange(y_class_label.shape[1]):
-                for posi in posi_zone:
-                    x1, x2 = posi[0] / reduced_x, posi[2] / reduced_x
-                    x3, x4 = posi[4] / reduced_x, posi[6] / reduced_x
-                    y1, y2 = posi[1] / reduced_y, posi[3] / reduced_y
-                    y3, y4 = posi[5] / reduced_y, posi[7] / reduced_y
-                    posi_poly = [(x1, y1), (x2, y2), (x3, y3), (x4, y4)]
-                    if point_check.point_in_polygon(ix, jy, posi_poly):
-                        y_class_label[ix][jy] = 1
-                for gray in gray_zone:
-                    x1, x2 = gray[0] / reduced_x, gray[2] / reduced_x
-                    x3, x4 = gray[4] / reduced_x, gray[6] / reduced_x
-                    y1, y2 = gray[1] / reduced_y, gray[3] / reduced_y
-                    y3, y4 = gray[5] / reduced_y, gray[7] / reduced_y
-                    gray_poly = [(x1, y1), (x2, y2), (x3, y3), (x4, y4)]
-                    if point_check.point_in_polygon(ix, jy, gray_poly):
-                        mask_label[ix][jy] = 0
-        # calculate ones's locations before expand the dimension of y_class_label
-        one_locs = np.where(y_class_label > 0)
-        y_class_label = np.expand_dims(y_class_label, axis=-1)
-        mask_label = np.expand_dims(mask_label, axis=-1)
-
-        # 3) generate regression data
-        y_regr_lable = np.zeros((80, 80, 8))
-        # visit all text pixel
-        for idx in xrange(len(one_locs[0])):
-            # judge text pixel belong to which box
-            for polygon in txtreg:
-                x1, x2 = polygon[0] / reduced_x, polygon[2] / reduced_x
-                x3, x4 = polygon[4] / reduced_x, polygon[6] / reduced_x
-                y1, y2 = polygon[1] / reduced_y, polygon[3] / reduced_y
-                y3, y4 = polygon[5] / reduced_y, polygon[7] / reduced_y
-                # 80 * 80 image's quardrangle
-                quard = [(x1, y1), (x2, y2), (x3, y3), (x4, y4)]
-                ix = one_locs[0][idx]
-                jy = one_locs[1][idx]
-                # (ix, jy) pixel belong to quardragle quard
-                if point_check.point_in_polygon(ix, jy, quard):
-                    top_left_x, top_left_y = quard[0][0], quard[0][1]
-                    top_righ_x, top_righ_y = quard[1][0], quard[1][1]
-                    dow_righ_x, dow_righ_y = quard[2][0], quard[2][1]
-                    dow_left_x, dow_left_y = quard[3][0], quard[3][1]
+        # 2) generate clsssification, mask and regression data
+        # the same label engine as all_train.image_ylabel_generator, keep h5 file and generator consistent
+        y_cls_mask_label, y_regr_cls_mask_label = label_engine.gene_labels(img.shape, txtreg)
+        if scale is not None:
+            img = np.multiply(img, scale, dtype=np.float32)
+        yield (img, y_cls_mask_label, y_regr_cls_mask_label)
 
-                    y_regr_lable[ix][jy][0] = top_left_x * 4 - ix * 4
-                    y_regr_lable[ix][jy][1] = top_left_y * 4 - jy * 4
-                    y_regr_lable[ix][jy][2] = top_righ_x * 4 - ix * 4
-                    y_regr_lable[ix][jy][3] = top_righ_y * 4 - jy * 4
-                    y_regr_lable[ix][jy][4] = dow_righ_x * 4 - ix * 4
-                    y_regr_lable[ix][jy][5] = dow_righ_y * 4 - jy * 4
-                    y_regr_lable[ix][jy][6] = dow_left_x * 4 - ix * 4
-                    y_regr_lable[ix][jy][7] = dow_left_y * 4 - jy * 4
-        y_regr_cls_mask_label = np.concatenate((y_regr_lable, y_class_label, mask_label), axis=-1)
-        y_cls_mask_label = np.concatenate((y_class_label, mask_label), axis=-1)
-        yield (scale * img, y_cls_mask_label, y_regr_cls_mask_label)
 
-
-def gene_h5_train_file(data_path, h5_name):
+def gene_h5_train_file(data_path, h5_name, crop_size=320, compression='lzf', block_size=256):
     """
     read training txt and image file, then generate y_cls_label, y_regr_label, mask_label, and write these label
     into h5 file
-    :param data_path: jpg and txt file path
+    samples are streamed into resizable datasets block by block, memory use does not depend on the number of images
+    X_train is uint8 (not normalized, readers multiply it by 1/255.0), Y_train_cls is uint8, Y_train_merge is float32,
+    each chunk is one sample, so reading shuffled rows only decompresses the rows needed
+    :param data_path: jpg and txt file path, or split list written by tools.split_dataset
     :param h5_name:
-    :return: No return value, just write h5 file on disk
+    :param crop_size: cropped image size
+    :param compression: h5py compression, 'lzf', 'gzip' or None
+    :param block_size: number of samples written at once
+    :return: No return value, just write h5 file on disk, ValueError if no sample is usable
     """
-    img = []
-    y_cls_mask = []
-    y_reg_cls_mask = []
-    os.chdir(data_path)
-    jpgfiles = glob.glob('*.jpg')
-    idx = 1
-    # the position of generator objector is very important
-    gene_obj = image_output_pair(data_path, 1/255.0)
-    while True:
-        if idx == len(jpgfiles):
-            break
-        print '\t{0}/{1}'.format(idx, len(jpgfiles))
-        # the position of generator objector is very important
-        # gene_obj = image_output_pair(data_path, 1/255.0)
-        img_it, y_cls_mask_it, y_reg_cls_mask_it = gene_obj.next()
-        img.append(img_it)
-        y_cls_mask.append(y_cls_mask_it)
-        y_reg_cls_mask.append(y_reg_cls_mask_it)
-        idx += 1
-
-    # img => (320, 320, 3)
-    # after np.stack => (19041, 320, 320, 3)
-    img_input = np.stack(img, axis=0)
-    y_cls = np.stack(y_cls_mask, axis=0)
-    y_reg = np.stack(y_reg_cls_mask, axis=0)
-    print 'input data shape is {0}'.format(img_input.shape)
-    print 'y_cls data shape is {0}'.format(y_cls.shape)
-    print 'y_reg data shape is {0}'.format(y_reg.shape)
-    
-    # wirte data
+    num_jpg = len(annotation_store.load_images(data_path))
     h5 = '/home/yuquanjie/Documents/train_' + h5_name
-    file_write = h5py.File(h5, 'w')
-    file_write.create_dataset('X_train', data=img_input)
-    file_write.create_dataset('Y_train_cls', data=y_cls)
-    file_write.create_dataset('Y_train_merge', data=y_reg)
-    file_write.close()
+    tmp_h5 = '{0}.{1}.tmp'.format(h5, os.getpid())
+    with h5py.File(tmp_h5, 'w') as file_write:
+        datasets, blocks = [], []
+        num_written = 0
+        for idx, sample in enumerate(image_output_pair(data_path, crop_size=crop_size)):
+            if idx % 1000 == 0:
+                print '\t{0}/{1}'.format(idx, num_jpg)
+            if not datasets:
+                # create datasets from the first sample's shape and dtype
+                for name, data in zip(('X_train', 'Y_train_cls', 'Y_train_merge'), sample):
+                    datasets.append(file_write.create_dataset(name, (0, ) + data.shape, dtype=data.dtype,
+                                                              maxshape=(None, ) + data.shape,
+                                                              chunks=(1, ) + data.shape, compression=compression))
+                    blocks.append([])
+            for block, data in zip(blocks, sample):
+                block.append(data)
+            if len(blocks[0]) == block_size:
+                num_written = _append_block(datasets, blocks, num_written)
+        if blocks and blocks[0]:
+            num_written = _append_block(datasets, blocks, num_written)
+        for dataset in datasets:
+            print '{0} data shape is {1}'.format(dataset.name, dataset.shape)
+    if not datasets:
+        # no usable sample, a h5 file without datasets is not written
+        os.remove(tmp_h5)
+        raise ValueError('no usable sample in {0}'.format(data_path))
+    os.rename(tmp_h5, h5)
+
+
+def _append_block(datasets, blocks, num_written):
+    """
+    append buffered samples to resizable datasets and empty the buffers
+    :return: number of samples in the datasets
+    """
+    for dataset, block in zip(datasets, blocks):
+        dataset.resize(num_written + len(block), axis=0)
+        dataset[num_written:] = np.stack(block)
+    num_written += len(blocks[0])
+    for block in blocks:
+        del block[:]
+    return num_written
 
 
 if __name__ == '__main__':
@@ -394,8 +275,9 @@ if __name__ == '__main__':
 
     write_h5 = False
     if write_h5:
-        jpg_txt_dir = '/home/yuquanjie/Documents/splited_train_data/train_' + sys.argv[1]
-        gene_h5_train_file(jpg_txt_dir, sys.argv[1])
+        # split lists written by python -m tools.split_dataset /home/yuquanjie/Documents/icdar2017_crop_center 4000
+        crop_dir = '/home/yuquanjie/Documents/icdar2017_crop_center'
+        gene_h5_train_file(split_dataset.split_path(crop_dir, 'train_' + sys.argv[1]), sys.argv[1])
 
 
 
@@ -0,0 +1,199 @@
+import os
+import threading
+import Queue
+import numpy as np
+import h5py
+
+# datasets written by get_data.gene_h5_train_file
+H5_KEYS = ('X_train', 'Y_train_cls', 'Y_train_merge')
+
+
+class MultiH5Dataset(object):
+    """
+    lazy view of several h5 files concatenated along the sample axis, nothing is read until a batch is requested
+    global sample index i is row i - offsets[k] of file k, offsets[k] <= i < offsets[k + 1]
+    """
+    def __init__(self, filelist, keys=H5_KEYS):
+        """
+        :param filelist: list of h5 file path
+        :param keys: dataset names, every file has the same datasets with the same number of rows
+        """
+        self.filelist = list(filelist)
+        self.keys = tuple(keys)
+        self._files = {}
+        self._pid = None
+        sizes = [self._file(file_idx)[self.keys[0]].shape[0] for file_idx in xrange(len(self.filelist))]
+        self.offsets = np.zeros(len(self.filelist) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(sizes)
+
+    def _file(self, file_idx):
+        # h5 files opened before fork can not be shared by worker processes, reopen them in each process
+        if self._pid != os.getpid():
+            self._files = {}
+            self._pid = os.getpid()
+        if file_idx not in self._files:
+            self._files[file_idx] = h5py.File(self.filelist[file_idx], 'r')
+        return self._files[file_idx]
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def shape(self, key):
+        """
+        :param key: dataset name
+        :return: shape of the concatenated dataset
+        """
+        return (len(self), ) + self._file(0)[key].shape[1:]
+
+    def locate(self, indices):
+        """
+        :param indices: global sample indices
+        :return: A tuple (file indices, rows in the files), numpy arrays
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        file_idx = np.searchsorted(self.offsets, indices, side='right') - 1
+        return file_idx, indices - self.offsets[file_idx]
+
+    def read(self, indices):
+        """
+        read the rows of a batch, rows of each file are read in increasing order (h5py fancy indexing requires it)
+        :param indices: global sample indices, any order
+        :return: a list of numpy array, one for each key, rows are in the order of indices
+        """
+        file_idx, rows = self.locate(indices)
+        batch = [np.empty((len(rows), ) + self._file(0)[key].shape[1:], dtype=self._file(0)[key].dtype)
+                 for key in self.keys]
+        for k in np.unique(file_idx):
+            selected = np.nonzero(file_idx == k)[0]
+            uniq_rows, inverse = np.unique(rows[selected], return_inverse=True)
+            # contiguous rows are read as one slice
+            if uniq_rows[-1] - uniq_rows[0] + 1 == len(uniq_rows):
+                rows_slice = slice(uniq_rows[0], uniq_rows[-1] + 1)
+            else:
+                rows_slice = list(uniq_rows)
+            for key, data in zip(self.keys, batch):
+                data[selected] = self._file(k)[key][rows_slice][inverse]
+        return batch
+
+    def close(self):
+        for h5_file in self._files.values():
+            h5_file.close()
+        self._files = {}
+
+
+def prefetch(generator, size=4):
+    """
+    run a generator in a background thread, up to size items are produced ahead of the consumer
+    h5py reading, jpg decoding and numpy work overlap with training, which releases the GIL
+    :param generator: python generator
+    :param size: maximum number of prefetched items
+    :return: python generator, the same items in the same order
+    """
+    queue = Queue.Queue(maxsize=size)
+    end = object()
+
+    def produce():
+        try:
+            for item in generator:
+                queue.put(item)
+        except Exception as e:
+            queue.put(e)
+        queue.put(end)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item = queue.get()
+        if item is end:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+class ChunkShuffleReader(object):
+    """
+    shuffled minibatches of a h5 file with bounded memory, for fit_generator
+    each epoch visits the blocks of chunk-aligned rows in a random order, every block is read with one slice, rows of
+    buffer_blocks blocks are shuffled together, so only the buffer is in memory and rows are still well mixed
+    """
+    def __init__(self, h5_path, keys=('X_train', 'Y_train_merge'), batch_size=32, seed=0, buffer_blocks=16,
+                 block_rows=None, scale=1/255.0, transform=None):
+        """
+        :param h5_path: h5 file path
+        :param keys: dataset names, the first one is network input, the others are network outputs
+        :param batch_size: batch size
+        :param seed: random seed of shuffling
+        :param buffer_blocks: number of blocks shuffled together
+        :param block_rows: rows of a block, None means the chunk rows of the input dataset (at least 16)
+        :param scale: normalization parameter of uint8 images, images stored as float are normalized already,
+                      None means uint8 images for a model with uint8 input
+        :param transform: function (x_batch, list of y_batch) => (x, y) fed to the model, None means y is the only
+                          output (or the list of outputs)
+        """
+        self.h5_path = h5_path
+        self.keys = tuple(keys)
+        self.batch_size = batch_size
+        self.seed = seed
+        self.buffer_blocks = buffer_blocks
+        self.scale = scale
+        self.transform = transform
+        with h5py.File(h5_path, 'r') as h5_file:
+            dataset = h5_file[self.keys[0]]
+            self.num_rows = dataset.shape[0]
+            if block_rows is None:
+                block_rows = max(dataset.chunks[0] if dataset.chunks else 1, 16)
+        self.block_rows = block_rows
+        self.epoch = 0
+
+    def __len__(self):
+        # steps per epoch, the last batch of a epoch may be smaller
+        return int(np.ceil(self.num_rows / float(self.batch_size)))
+
+    def _make_batch(self, rows):
+        x_batch, y_batches = rows[0], rows[1:]
+        if x_batch.dtype == np.uint8 and self.scale is not None:
+            # normalize image data from [0, 255] to [0, 1]
+            x_batch = np.multiply(x_batch, self.scale, dtype=np.float32)
+        if self.transform is not None:
+            return self.transform(x_batch, y_batches)
+        return x_batch, y_batches[0] if len(y_batches) == 1 else y_batches
+
+    def epoch_batches(self, epoch):
+        """
+        :param epoch: epoch number, the order only depends on (seed, epoch)
+        :return: python generator of one epoch's batches, every row appears exactly once
+        """
+        rng = np.random.RandomState([self.seed, epoch])
+        block_starts = rng.permutation(np.arange(0, self.num_rows, self.block_rows))
+        with h5py.File(self.h5_path, 'r') as h5_file:
+            datasets = [h5_file[key] for key in self.keys]
+            pending = [np.zeros((0, ) + dataset.shape[1:], dtype=dataset.dtype) for dataset in datasets]
+            for group in xrange(0, len(block_starts), self.buffer_blocks):
+                # read a buffer of blocks, then shuffle rows inside the buffer
+                starts = np.sort(block_starts[group: group + self.buffer_blocks])
+                buffers = [np.concatenate([dataset[start: start + self.block_rows] for start in starts])
+                           for dataset in datasets]
+                order = rng.permutation(len(buffers[0]))
+                pending = [np.concatenate((rest, buf[order])) for rest, buf in zip(pending, buffers)]
+                while len(pending[0]) >= self.batch_size:
+                    yield self._make_batch([rows[:self.batch_size] for rows in pending])
+                    pending = [rows[self.batch_size:] for rows in pending]
+            if len(pending[0]):
+                yield self._make_batch(pending)
+
+    def _batches(self):
+        while True:
+            for batch in self.epoch_batches(self.epoch):
+                yield batch
+            self.epoch += 1
+
+    def batches(self, prefetch_size=4):
+        """
+        :param prefetch_size: number of batches read ahead in a background thread, 0 means no prefetching
+        :return: endless python generator of batches, len(self) batches make a epoch
+        """
+        if prefetch_size <= 0:
+            return self._batches()
+        return prefetch(self._batches(), prefetch_size)
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+
+
+class ImageCache(object):
+    """
+    in-process cache of decoded images and their text regions, keyed by image path
+    the least recently used entries are evicted when the decoded images are larger than max_bytes
+    cached images are read-only, copy them before drawing on them
+    one cache can be shared by several generators (e.g. training and validation) of the same process, worker
+    processes of fit_generator(use_multiprocessing=True) each get their own copy
+    """
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        """
+        :param max_bytes: size budget of the cached images and text regions
+        """
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # generators may run in keras' loader thread and the prefetch thread at the same time
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        :param key: image path
+        :return: A tuple (image, text region), None if not cached
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            # mark as recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry
+
+    def put(self, key, img, txtreg):
+        """
+        :param key: image path
+        :param img: decoded image, uint8 numpy array
+        :param txtreg: text region numpy array (N, 8)
+        """
+        img.flags.writeable = False
+        nbytes = img.nbytes + txtreg.nbytes
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.total_bytes -= old_entry[0].nbytes + old_entry[1].nbytes
+            self._entries[key] = (img, txtreg)
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                _, (old_img, old_txtreg) = self._entries.popitem(last=False)
+                self.total_bytes -= old_img.nbytes + old_txtreg.nbytes
+
+    def read(self, source, idx):
+        """
+        read a image and it's text region through the cache
+        :param source: annotation_store.AnnotationStore or shard.ShardReader object
+        :param idx: image index of source
+        :return: A tuple (image, text region), image is None if it is not readable (not cached)
+        """
+        key = source.path(idx)
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        img, txtreg = source.read_image(idx), source.txtreg(idx)
+        if img is not None:
+            self.put(key, img, txtreg)
+        return img, txtreg
+
+    def hit_rate(self):
+        """
+        :return: hits / (hits + misses)
+        """
+        return self.hits / float(max(self.hits + self.misses, 1))
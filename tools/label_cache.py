@@ -0,0 +1,169 @@
+import os
+import sys
+import glob
+import hashlib
+import tempfile
+import zipfile
+import numpy as np
+import tools.label_engine as label_engine
+import tools.geometry as geometry
+import tools.annotation_store as annotation_store
+
+
+class LabelCache(object):
+    """
+    on-disk cache of the targets generated by label_engine.gene_labels
+    each entry is keyed by the image's annotation content (text region coordinates) and the label parameters,
+    entries are stored packed: classification and mask label as bits, regression label only on positive pixels
+    the least recently used entries are evicted when the cache is larger than max_bytes
+    """
+    def __init__(self, cache_dir, max_bytes=4 * 1024 ** 3, geom=geometry.DEFAULT):
+        """
+        :param cache_dir: cache directory, created if not exist
+        :param max_bytes: size budget of the cache directory
+        :param geom: geometry.Geometry object, output feature map size and stride
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.geom = geom
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def key(self, img_shape, txtreg):
+        """
+        :param img_shape: image shape, (height, width, channel)
+        :param txtreg: text region list or numpy array (N, 8)
+        :return: hex digest of annotation content and label parameters
+        """
+        # annotations are float32 in annotation_store, a list of python float gets the same key
+        sha = hashlib.sha1(np.asarray(txtreg, dtype=np.float32).reshape(-1, 8).tobytes())
+        params = (img_shape[0], img_shape[1], self.geom.out_size, self.geom.stride, label_engine.TIE_BREAK)
+        sha.update(','.join(str(param) for param in params))
+        return sha.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def _entries(self):
+        """
+        :return: a list of (path, size, last access time) of all cached entries
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*', '*.npz')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # evicted by another process
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, img_shape, txtreg):
+        """
+        :return: A tuple (y_cls_mask_label, y_regr_cls_mask_label), None if not cached
+        """
+        path = self._path(self.key(img_shape, txtreg))
+        try:
+            with np.load(path) as packed:
+                cls_bits, mask_bits, regr = packed['cls'], packed['mask'], packed['regr']
+            # mark as recently used
+            os.utime(path, None)
+        except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        out_size = self.geom.out_size
+        y_class_label = np.unpackbits(cls_bits)[:out_size * out_size].reshape(out_size, out_size)
+        mask_label = np.unpackbits(mask_bits)[:out_size * out_size].reshape(out_size, out_size)
+        y_regr_lable = np.zeros((out_size, out_size, 8), dtype=label_engine.REGR_DTYPE)
+        y_regr_lable[y_class_label > 0] = regr
+        return label_engine.pack_labels(y_class_label, mask_label, y_regr_lable)
+
+    def put(self, img_shape, txtreg, y_regr_cls_mask_label):
+        """
+        write a entry, the file is renamed into place so concurrent readers never see a partial entry
+        :param y_regr_cls_mask_label: (out_size, out_size, 10), regression, classification and mask label
+        """
+        path = self._path(self.key(img_shape, txtreg))
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # created by another process
+                pass
+        positive = y_regr_cls_mask_label[:, :, 8] > 0
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, cls=np.packbits(positive), mask=np.packbits(y_regr_cls_mask_label[:, :, 9] > 0),
+                     regr=y_regr_cls_mask_label[:, :, 0:8][positive])
+        os.rename(tmp_path, path)
+        self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def get_or_gene(self, img_shape, txtreg):
+        """
+        read the targets from cache, generate and cache them if not cached
+        :return: A tuple (y_cls_mask_label, y_regr_cls_mask_label)
+        """
+        labels = self.get(img_shape, txtreg)
+        if labels is None:
+            labels = label_engine.gene_labels(img_shape, txtreg, self.geom)
+            self.put(img_shape, txtreg, labels[1])
+        return labels
+
+    def evict(self, ratio=0.9):
+        """
+        remove the least recently used entries until the cache is smaller than ratio * max_bytes
+        :param ratio: target size / max_bytes after evicting
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.total_bytes <= ratio * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.total_bytes -= size
+
+    def warm(self, store, crop_size=320):
+        """
+        generate and cache the targets of all images in a annotation store up front
+        the text regions are scaled from the cropped images to the geometry's input size the same way as
+        all_train.read_img_txtreg, so the entries have the keys the training looks up
+        :param store: annotation_store.AnnotationStore object
+        :param crop_size: size of the cropped images on disk
+        :return: number of generated entries
+        """
+        input_size = self.geom.input_size
+        img_shape = (input_size, input_size)
+        num_gene = 0
+        for idx in xrange(len(store)):
+            if idx % 1000 == 0:
+                print '\t{0}/{1}'.format(idx, len(store))
+            txtreg = store.txtreg(idx)
+            # images without text region are skipped by the training
+            if len(txtreg) == 0:
+                continue
+            if input_size != crop_size:
+                txtreg = txtreg * (float(input_size) / crop_size)
+            if os.path.isfile(self._path(self.key(img_shape, txtreg))):
+                continue
+            self.put(img_shape, txtreg, label_engine.gene_labels(img_shape, txtreg, self.geom)[1])
+            num_gene += 1
+        return num_gene
+
+
+if __name__ == '__main__':
+    # python -m tools.label_cache crop_dir cache_dir [max_gigabytes] [geometry name], crop_dir has 320 * 320 crops
+    max_gb = float(sys.argv[3]) if len(sys.argv) > 3 else 4
+    geom = geometry.get_geometry(sys.argv[4] if len(sys.argv) > 4 else 'default')
+    cache = LabelCache(sys.argv[2], int(max_gb * 1024 ** 3), geom)
+    print 'warming label cache {0} from {1}'.format(sys.argv[2], sys.argv[1])
+    num_gene = cache.warm(annotation_store.load_or_build(sys.argv[1]))
+    print 'generated {0} entries, cache size {1} bytes'.format(num_gene, cache.total_bytes)
@@ -0,0 +1,157 @@
+import numpy as np
+import tools.point_check as point_check
+import tools.geometry as geometry
+
+# which box a text pixel belongs to when boxes overlap, 'smallest' box wins or the 'last' box in txtreg wins
+TIE_BREAK = 'smallest'
+# dtype of generated targets, classification and mask label are 0 / 1 flags, regression label are pixel offsets,
+# they are converted to the loss dtype(float32) only when feeding the model
+CLS_MASK_DTYPE = np.uint8
+REGR_DTYPE = np.float32
+
+
+def grid_in_polygons(polys, geom=geometry.DEFAULT):
+    """
+    PNPoly test of every pixel of the output feature map against several polygons at once,
+    same as point_check.point_in_polygon(ix, jy, poly) for each pixel (ix, jy)
+    :param polys: numpy array, shape (M, K, 2), M polygons, each has K (x, y) vertices
+    :param geom: geometry.Geometry object, output feature map size
+    :return: bool numpy array, shape (M, out_size, out_size)
+    """
+    polys = np.asarray(polys, dtype=np.float64)
+    in_polys = point_check.points_in_polygons(geom.grid_points, polys)
+    return in_polys.reshape(len(polys), geom.out_size, geom.out_size)
+
+
+def get_zone_array(quads, reduced_x=1.0, reduced_y=1.0):
+    """
+    split all text regions into positive zone and gray zone(not care region) at once, array version of
+    get_data.get_zone, the short side of each quardrangle is split into 1/4 gray, 1/2 positive and 1/4 gray
+    :param quads: numpy array (float32 or float64), shape (N, 8), each row is [x1, y1, x2, y2, x3, y3, x4, y4]
+    :param reduced_x: x-axis reduced scale, zones are divided by it, e.g. image width / feature map width
+    :param reduced_y: y-axis reduced scale
+    :return: A tuple (gray_zone, posi_zone)
+             gray_zone numpy array, shape (2N, 8), row 2i and 2i + 1 are the two gray zones of box i
+             posi_zone numpy array, shape (N, 8)
+    """
+    # computing in float64, same as get_data.get_zone on python float
+    pts = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 1, 2)
+    p1, p2, p3, p4 = pts[:, 0], pts[:, 1], pts[:, 2], pts[:, 3]
+    line_1_2_len = np.sqrt(np.sum(np.square(p1 - p2), axis=-1))
+    line_1_4_len = np.sqrt(np.sum(np.square(p1 - p4), axis=-1))
+    # short side is line_1_2, shape (N, 1, 1)
+    short_1_2 = (line_1_2_len <= line_1_4_len)[:, :, None]
+
+    # short side is line_1_2
+    mid_point_1_2, mid_point_3_4 = (p1 + p2) / 2, (p3 + p4) / 2
+    m1_a, m2_a = (p1 + mid_point_1_2) / 2, (p2 + mid_point_1_2) / 2
+    m3_a, m4_a = (p3 + mid_point_3_4) / 2, (p4 + mid_point_3_4) / 2
+    # short side is line_1_4
+    mid_point_1_4, mid_point_2_3 = (p1 + p4) / 2, (p2 + p3) / 2
+    m1_b, m4_b = (p1 + mid_point_1_4) / 2, (p4 + mid_point_1_4) / 2
+    m2_b, m3_b = (p2 + mid_point_2_3) / 2, (p3 + mid_point_2_3) / 2
+
+    posi_zone = np.where(short_1_2, np.concatenate((m1_a, m2_a, m3_a, m4_a), axis=1),
+                         np.concatenate((m1_b, m2_b, m3_b, m4_b), axis=1))
+    gray_zone_1 = np.where(short_1_2, np.concatenate((p1, m1_a, m4_a, p4), axis=1),
+                           np.concatenate((p1, p2, m2_b, m1_b), axis=1))
+    gray_zone_2 = np.where(short_1_2, np.concatenate((m2_a, p2, p3, m3_a), axis=1),
+                           np.concatenate((m4_b, m3_b, p3, p4), axis=1))
+    gray_zone = np.stack((gray_zone_1, gray_zone_2), axis=1)
+
+    reduced = np.array([reduced_x, reduced_y])
+    return (gray_zone / reduced).reshape(-1, 8), (posi_zone / reduced).reshape(-1, 8)
+
+
+def to_feature_polys(zones, reduced_x, reduced_y):
+    """
+    convert a list (or array) of 8 coordinates zones on the raw image into polygons on the feature map
+    :param zones: [[x1, y1, x2, y2, x3, y3, x4, y4], ...]
+    :param reduced_x: x-axis reduced scale
+    :param reduced_y: y-axis reduced scale
+    :return: numpy array, shape (M, 4, 2)
+    """
+    zones = np.asarray(zones, dtype=np.float64).reshape(-1, 4, 2)
+    return zones / np.array([reduced_x, reduced_y])
+
+
+def polygon_area(polys):
+    """
+    shoelace formula
+    :param polys: numpy array, shape (M, K, 2)
+    :return: numpy array, shape (M, ), area of each polygon
+    """
+    x, y = polys[:, :, 0], polys[:, :, 1]
+    return 0.5 * np.abs(np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1))
+
+
+def box_owner_map(quards, geom=geometry.DEFAULT, tie_break=TIE_BREAK):
+    """
+    ownership raster, the index of the box each feature map pixel belongs to
+    :param quards: numpy array, shape (N, 4, 2), boxes on the feature map
+    :param geom: geometry.Geometry object, output feature map size
+    :param tie_break: rule for pixels in several boxes
+                      'smallest', the box with the smallest area wins, equal area boxes fall back to 'last'
+                      'last', the last box in quards wins
+    :return: int16 numpy array, shape (out_size, out_size), -1 means the pixel is not in any box
+    """
+    if tie_break == 'smallest':
+        # larger boxes are written first, then overwritten by smaller ones
+        order = np.argsort(-polygon_area(quards), kind='mergesort')
+    elif tie_break == 'last':
+        order = np.arange(len(quards))
+    else:
+        raise ValueError('unknown tie_break {0}'.format(tie_break))
+    owner = -np.ones((geom.out_size, geom.out_size), dtype=np.int16)
+    in_quards = grid_in_polygons(quards, geom)
+    for k in order:
+        owner[in_quards[k]] = k
+    return owner
+
+
+def gene_labels(img_shape, txtreg, geom=geometry.DEFAULT, tie_break=TIE_BREAK):
+    """
+    rasterize all text regions of a image in one pass, generate classification, mask and regression label
+    :param img_shape: image shape, (height, width, channel)
+    :param txtreg: text region list or numpy array (N, 8), each element is [x1, y1, x2, y2, x3, y3, x4, y4]
+    :param geom: geometry.Geometry object, output feature map size and stride
+    :param tie_break: which box a text pixel belongs to when boxes overlap, see box_owner_map
+    :return: A tuple (y_cls_mask_label, y_regr_cls_mask_label)
+             y_cls_mask_label (out_size, out_size, 2), CLS_MASK_DTYPE, classification label and mask label
+             y_regr_cls_mask_label (out_size, out_size, 10), REGR_DTYPE, regression label, classification label
+             and mask label
+    """
+    out_size, stride = geom.out_size, geom.stride
+    # x-axis and y-axis reduced scale
+    reduced_x, reduced_y = float(img_shape[1]) / out_size, float(img_shape[0]) / out_size
+    # split text region into gray zone and positive zone, on the feature map
+    gray_zone, posi_zone = get_zone_array(txtreg, reduced_x, reduced_y)
+    # 1) classification label, pixel in any positive zone is 1, negative lable is 0
+    y_class_label = grid_in_polygons(posi_zone.reshape(-1, 4, 2), geom).any(axis=0)
+    # 2) mask label, pixel in any gray zone is 0
+    mask_label = ~grid_in_polygons(gray_zone.reshape(-1, 4, 2), geom).any(axis=0)
+
+    # 3) regression label, text pixel's offsets to the 4 corners of the box it belongs to
+    y_regr_lable = np.zeros((out_size, out_size, 8), dtype=REGR_DTYPE)
+    quards = to_feature_polys(txtreg, reduced_x, reduced_y)
+    owner = box_owner_map(quards, geom, tie_break)
+    # only text pixels have regression label
+    ix, jy = np.nonzero((owner >= 0) & y_class_label)
+    owner_quards = quards[owner[ix, jy]]
+    y_regr_lable[ix, jy, 0::2] = owner_quards[:, :, 0] * stride - ix[:, None] * stride
+    y_regr_lable[ix, jy, 1::2] = owner_quards[:, :, 1] * stride - jy[:, None] * stride
+
+    return pack_labels(y_class_label, mask_label, y_regr_lable)
+
+
+def pack_labels(y_class_label, mask_label, y_regr_lable):
+    """
+    concatenate classification, mask and regression label into the network's targets
+    :param y_class_label: (out_size, out_size), classification label
+    :param mask_label: (out_size, out_size), mask label
+    :param y_regr_lable: (out_size, out_size, 8), regression label
+    :return: A tuple (y_cls_mask_label, y_regr_cls_mask_label), see gene_labels
+    """
+    y_cls_mask_label = np.stack((y_class_label, mask_label), axis=-1).astype(CLS_MASK_DTYPE)
+    y_regr_cls_mask_label = np.concatenate((y_regr_lable, y_cls_mask_label), axis=-1).astype(REGR_DTYPE)
+    return y_cls_mask_label, y_regr_cls_mask_label
@@ -0,0 +1,227 @@
+import os
+import sys
+import numpy as np
+
+# suffix of the manifest file saved next to (not inside) a image directory, see default_path
+MANIFEST_SUFFIX = '.manifest.npz'
+# suffix of the list of valid samples written by tools.check_dataset, saved next to the image directory
+VALID_SUFFIX = '.valid.txt'
+
+
+def default_path(directory):
+    """
+    the manifest of directory a/b is a/b.manifest.npz, saving it does not change the mtime of a/b
+    :param directory: image directory
+    :return: manifest file path
+    """
+    return os.path.normpath(directory) + MANIFEST_SUFFIX
+
+
+def valid_list_path(directory):
+    """
+    :param directory: image directory
+    :return: file path of the list of valid samples of directory
+    """
+    return os.path.normpath(directory) + VALID_SUFFIX
+
+
+def save_valid_list(jpg_paths, list_path):
+    """
+    write a list of valid samples, one jpg path per line, written to a temporary file and renamed into place
+    :param jpg_paths: list of jpg file path
+    :param list_path: list file path
+    """
+    tmp_path = '{0}.{1}.tmp'.format(list_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        for jpg_path in jpg_paths:
+            f.write(jpg_path + '\n')
+    os.rename(tmp_path, list_path)
+
+
+def load_valid_list(list_path):
+    """
+    :param list_path: list file path
+    :return: list of jpg file path
+    """
+    with open(list_path, 'r') as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+
+def scan_directory(directory):
+    """
+    list the jpg and txt file pairs of a directory, only paired files are stat
+    :param directory: directory of jpg and txt files
+    :return: A tuple (names, stats)
+             names, sorted list of file names without extension
+             stats, numpy array (len(names), 4), jpg size, jpg mtime, txt size, txt mtime
+    """
+    jpgs, txts = set(), set()
+    for file_name in os.listdir(directory):
+        name, ext = os.path.splitext(file_name)
+        if ext == '.jpg':
+            jpgs.add(name)
+        elif ext == '.txt':
+            txts.add(name)
+    names = sorted(jpgs & txts)
+    return names, stat_pairs(directory, names)
+
+
+def stat_pairs(directory, names):
+    """
+    :param directory: directory of jpg and txt files
+    :param names: list of file name without extension
+    :return: numpy array (len(names), 4), jpg size, jpg mtime, txt size, txt mtime, OSError if a file is missing
+    """
+    stats = np.zeros((len(names), 4), dtype=np.float64)
+    for idx, name in enumerate(names):
+        jpg_stat = os.stat(os.path.join(directory, name + '.jpg'))
+        txt_stat = os.stat(os.path.join(directory, name + '.txt'))
+        stats[idx] = (jpg_stat.st_size, jpg_stat.st_mtime, txt_stat.st_size, txt_stat.st_mtime)
+    return stats
+
+
+class Manifest(object):
+    """
+    jpg and txt file pairs of several directories, with file sizes and mtimes
+    each directory's mtime is recorded, refresh only rescans the directories whose mtime is changed
+    (adding, removing or renaming a file changes the mtime of it's directory)
+    editing a file in place does not change the directory's mtime, refresh(check_files=True) also compares the sizes
+    and mtimes of the pairs in unchanged directories
+    """
+    def __init__(self, dirs, dir_mtimes, dir_index, names, stats):
+        """
+        :param dirs: list of directory
+        :param dir_mtimes: float64 numpy array, mtime of each directory when it was scanned
+        :param dir_index: int32 numpy array, directory index of each pair
+        :param names: list of file name without extension of each pair
+        :param stats: float64 numpy array (num_pairs, 4), jpg size, jpg mtime, txt size, txt mtime of each pair
+        """
+        self.dirs = list(dirs)
+        self.dir_mtimes = np.asarray(dir_mtimes, dtype=np.float64)
+        self.dir_index = np.asarray(dir_index, dtype=np.int32)
+        self.names = list(names)
+        self.stats = np.asarray(stats, dtype=np.float64).reshape(-1, 4)
+
+    @classmethod
+    def build(cls, directories):
+        """
+        :param directories: list of directory of jpg and txt files
+        :return: Manifest object
+        """
+        return cls([], [], [], [], np.zeros((0, 4))).refresh(directories)
+
+    def refresh(self, directories=None, check_files=False):
+        """
+        rescan the directories whose mtime is changed, reuse the others' pairs
+        :param directories: list of directory, None means the manifest's directories
+        :param check_files: stat the pairs of unchanged directories too, finds files edited in place
+        :return: Manifest object, self if nothing is changed
+        """
+        directories = self.dirs if directories is None else [os.path.normpath(d) for d in directories]
+        dir_mtimes, dir_index, names, stats = [], [], [], []
+        changed = directories != self.dirs
+        for new_idx, directory in enumerate(directories):
+            mtime = os.stat(directory).st_mtime
+            old_idx = self.dirs.index(directory) if directory in self.dirs else -1
+            if old_idx >= 0 and self.dir_mtimes[old_idx] == mtime:
+                rows = np.nonzero(self.dir_index == old_idx)[0]
+                dir_names, dir_stats = [self.names[row] for row in rows], self.stats[rows]
+                if check_files:
+                    try:
+                        new_stats = stat_pairs(directory, dir_names)
+                    except OSError:
+                        # removed within the mtime resolution of the directory
+                        dir_names, new_stats = scan_directory(directory)
+                    if len(new_stats) != len(dir_stats) or not np.array_equal(new_stats, dir_stats):
+                        dir_stats = new_stats
+                        changed = True
+            else:
+                dir_names, dir_stats = scan_directory(directory)
+                changed = True
+            dir_mtimes.append(mtime)
+            dir_index.extend([new_idx] * len(dir_names))
+            names.extend(dir_names)
+            stats.append(dir_stats)
+        if not changed:
+            return self
+        return Manifest(directories, dir_mtimes, dir_index, names, np.concatenate(stats or [np.zeros((0, 4))]))
+
+    def save(self, manifest_path):
+        """
+        write the manifest, written to a temporary file and renamed into place
+        :param manifest_path: manifest file path
+        """
+        tmp_path = '{0}.{1}.tmp'.format(manifest_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, dirs=np.array(self.dirs, dtype=str), dir_mtimes=self.dir_mtimes, dir_index=self.dir_index,
+                     names=np.array(self.names, dtype=str), stats=self.stats)
+        os.rename(tmp_path, manifest_path)
+
+    @classmethod
+    def load(cls, manifest_path):
+        """
+        :param manifest_path: manifest file path
+        :return: Manifest object
+        """
+        with np.load(manifest_path) as saved:
+            return cls(saved['dirs'].tolist(), saved['dir_mtimes'], saved['dir_index'], saved['names'].tolist(),
+                       saved['stats'])
+
+    def __len__(self):
+        return len(self.names)
+
+    def pair_stats(self, non_empty=True):
+        """
+        :param non_empty: skip the pairs whose jpg file is empty, same order as jpg_paths
+        :return: numpy array (number of pairs, 4), jpg size, jpg mtime, txt size, txt mtime
+        """
+        if non_empty:
+            return self.stats[self.stats[:, 0] > 0]
+        return self.stats
+
+    def jpg_paths(self, non_empty=True):
+        """
+        :param non_empty: skip empty jpg files
+        :return: list of jpg file path
+        """
+        return [os.path.join(self.dirs[dir_idx], name + '.jpg')
+                for dir_idx, name, size in zip(self.dir_index, self.names, self.stats[:, 0])
+                if size > 0 or not non_empty]
+
+    def txt_paths(self, non_empty=True):
+        """
+        :param non_empty: skip the pairs whose jpg file is empty, same order as jpg_paths
+        :return: list of txt file path
+        """
+        return [os.path.join(self.dirs[dir_idx], name + '.txt')
+                for dir_idx, name, size in zip(self.dir_index, self.names, self.stats[:, 0])
+                if size > 0 or not non_empty]
+
+
+def load_or_build(directories, manifest_path=None, check_files=True):
+    """
+    load and refresh a manifest, build it if it does not exist, the manifest file is rewritten only when changed
+    :param directories: a directory or a list of directory of jpg and txt files
+    :param manifest_path: manifest file path, None means default_path of the (first) directory
+    :param check_files: stat every pair, see Manifest.refresh, False only rescans the directories whose mtime is
+                        changed (faster, misses files edited in place)
+    :return: Manifest object
+    """
+    if isinstance(directories, basestring):
+        directories = [directories]
+    manifest_path = manifest_path or default_path(directories[0])
+    try:
+        old_manifest = Manifest.load(manifest_path)
+    except (IOError, KeyError, ValueError):
+        old_manifest = Manifest([], [], [], [], np.zeros((0, 4)))
+    new_manifest = old_manifest.refresh(directories, check_files)
+    if new_manifest is not old_manifest:
+        new_manifest.save(manifest_path)
+    return new_manifest
+
+
+if __name__ == '__main__':
+    # python -m tools.manifest image_dir [image_dir ...]
+    manifest = load_or_build(sys.argv[1:])
+    print '{0} jpg and txt pairs in {1} directories, saved in {2}'.format(len(manifest), len(manifest.dirs),
+                                                                          default_path(sys.argv[1]))
@@ -0,0 +1,56 @@
+import numpy as np
+from shapely.geometry import Polygon
+import tools.resize_Image as resize_Image
+
+
+class TextCenterCrop(object):
+    """
+    online version of resize_Image.crop_image_from_textcenter and rotate_img, for training on the full size images
+    a text region is chosen randomly, the size * size window around it's center is cut, the text regions are clipped
+    in memory with the rules of resize_Image.intersect_cropped_rawtxtreg, then the crop is rotated by a random angle
+    nothing is written to disk, so every epoch draws new crops
+    """
+    def __init__(self, size=320, angles=(0, 90, 180, 270), jitter=0, max_tries=8):
+        """
+        :param size: cropped image size
+        :param angles: rotation angles to choose from, 0 means not rotated
+        :param jitter: the window center is moved by up to jitter pixels along each axis, 0 means the text center
+        :param max_tries: number of text regions tried before giving up on a image
+        """
+        self.size = size
+        self.angles = tuple(angles)
+        self.jitter = jitter
+        self.max_tries = max_tries
+
+    def __call__(self, img, txtreg, rng=np.random):
+        """
+        :param img: full size image
+        :param txtreg: text region numpy array (N, 8) on the full size image
+        :param rng: numpy.random.RandomState object or the numpy.random module
+        :return: A tuple (cropped image, float32 text region numpy array (M, 8)), None if no acceptable crop is found
+        """
+        if len(txtreg) == 0:
+            return None
+        # boxes are parsed once per image, not once per try
+        txtreg_index = resize_Image.TextRegionIndex(txtreg)
+        for _ in xrange(self.max_tries):
+            coord = txtreg_index.coords[rng.randint(len(txtreg_index))]
+            text_cen = [(coord[0] + coord[4]) / 2 + rng.uniform(-self.jitter, self.jitter),
+                        (coord[1] + coord[5]) / 2 + rng.uniform(-self.jitter, self.jitter)]
+            t_l, d_r = resize_Image.get_croppedimg_tl_dr_coord_ver2(img, text_cen, self.size)
+            if t_l is None or d_r is None:
+                continue
+            # the window is on integer pixels, the clipped regions match the cut image exactly
+            tl_x, tl_y = int(t_l[0]), int(t_l[1])
+            crop_img = Polygon([(tl_x, tl_y), (tl_x, tl_y + self.size), (tl_x + self.size, tl_y + self.size),
+                                (tl_x + self.size, tl_y)])
+            accepted, clipped = resize_Image.clip_cropped_rawtxtreg(crop_img, txtreg_index, tl_x, tl_y)
+            if not accepted or not clipped:
+                continue
+            cropped_img = img[tl_y: tl_y + self.size, tl_x: tl_x + self.size]
+            clipped = np.array(clipped, dtype=np.float64)
+            angle = self.angles[rng.randint(len(self.angles))]
+            if angle != 0:
+                cropped_img, clipped = resize_Image.rotate_crop(cropped_img, clipped, angle)
+            return cropped_img, clipped.astype(np.float32)
+        return None
@@ -1,25 +1,47 @@
+import numpy as np
+
+
+def points_in_polygons(points, polys):
+    """
+    - batched PNPoly algorithm, test N points against M polygons at once
+    - same semantics as point_in_polygon, points outside the polygon's bounding box are never in
+    :param points: numpy array, shape (N, 2), each row is (x, y)
+    :param polys: numpy array, shape (M, K, 2), M polygons, each has K vertices [(x1, y1), (x2, y2), ...]
+    :return: bool numpy array, shape (M, N), [m, n] is True if point n is in polygon m
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    polys = np.asarray(polys, dtype=np.float64)
+    if polys.size == 0:
+        return np.zeros((len(polys), len(points)), dtype=bool)
+    x, y = points[None, :, 0], points[None, :, 1]
+    vertx, verty = polys[:, :, 0], polys[:, :, 1]
+
+    nvert = polys.shape[1]
+    is_in = np.zeros((polys.shape[0], points.shape[0]), dtype=bool)
+    for i in xrange(nvert):
+        j = nvert - 1 if i == 0 else i - 1
+        xi, yi = vertx[:, i, None], verty[:, i, None]
+        xj, yj = vertx[:, j, None], verty[:, j, None]
+        # horizontal edges never straddle y, only avoid dividing by zero
+        denom = np.where(yj == yi, 1.0, yj - yi)
+        is_in ^= ((yi > y) != (yj > y)) & (x < (xj - xi) * (y - yi) / denom + xi)
+
+    in_bbox = (vertx.min(axis=1)[:, None] <= x) & (x <= vertx.max(axis=1)[:, None]) & \
+              (verty.min(axis=1)[:, None] <= y) & (y <= verty.max(axis=1)[:, None])
+    return is_in & in_bbox
+
+
 def point_in_polygon(x, y, verts):
     """
     - http://blog.leanote.com/post/iwantpython@163.com/d4d62c5dc860
     - PNPoly algorithm
     - xyverts  [(x1, y1), (x2, y2), (x3, y3), ...]
+    - thin wrapper of points_in_polygons, use points_in_polygons for many points or polygons
     """
     try:
         x, y = float(x), float(y)
     except:
         return False
-    vertx = [xyvert[0] for xyvert in verts]
-    verty = [xyvert[1] for xyvert in verts]
-
-    if not verts or not min(vertx) <= x <= max(vertx) or not min(verty) <= y <= max(verty):
+    if not verts:
         return False
-
-    nvert = len(verts)
-    is_in = False
-    for i in range(nvert):
-        j = nvert - 1 if i == 0 else i - 1
-        if ((verty[i] > y) != (verty[j] > y)) and (
-                    x < (vertx[j] - vertx[i]) * (y - verty[i]) / (verty[j] - verty[i]) + vertx[i]):
-            is_in = not is_in
-
-    return is_in
+    return bool(points_in_polygons([(x, y)], [verts])[0, 0])
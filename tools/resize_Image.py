@@ -12,11 +12,56 @@ import tools.get_data as get_data
 import tools.mydraw as mydraw
 import random as rd
 import os
+import sys
 import string
+import zlib
+import multiprocessing
 from shapely.geometry import Polygon
 
+# completion journal of a crop output directory, one finished raw image path per line
+JOURNAL_NAME = 'crop.journal'
 
-def intersect_cropped_rawtxtreg(crop_img_poly, raw_img_txtregion, tl_x, tl_y):
+
+class TextRegionIndex(object):
+    """
+    text regions of a raw image, parsed and turned into shapely polygons once per image
+    the bounding boxes are kept in a numpy array, so the boxes near a window (or many windows) are found by a
+    vectorized overlap test, and only those go through shapely
+    """
+    def __init__(self, raw_img_txtregion):
+        """
+        :param raw_img_txtregion: raw image's text region, list of 8 coordinates (str or float) or numpy array (N, 8)
+        """
+        self.coords = np.array([[string.atof(value) for value in polygon[0:8]] for polygon in raw_img_txtregion],
+                               dtype=np.float64).reshape(-1, 8)
+        self.polys = [Polygon([(x1, y1), (x4, y4), (x3, y3), (x2, y2)])
+                      for x1, y1, x2, y2, x3, y3, x4, y4 in self.coords]
+        xs, ys = self.coords[:, 0::2], self.coords[:, 1::2]
+        # min x, min y, max x, max y of each box
+        self.bounds = np.stack([xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=1)
+
+    def __len__(self):
+        return len(self.polys)
+
+    def overlap(self, windows):
+        """
+        bounding box overlap of windows and boxes, touching counts as overlapping (same as shapely's intersects)
+        :param windows: numpy array (M, 4), min x, min y, max x, max y of each window
+        :return: bool numpy array (M, number of boxes)
+        """
+        windows = np.asarray(windows, dtype=np.float64).reshape(-1, 4)
+        return (windows[:, 0:1] <= self.bounds[:, 2]) & (windows[:, 2:3] >= self.bounds[:, 0]) & \
+               (windows[:, 1:2] <= self.bounds[:, 3]) & (windows[:, 3:4] >= self.bounds[:, 1])
+
+    def candidates(self, window):
+        """
+        :param window: min x, min y, max x, max y of a window, e.g. shapely's Polygon.bounds
+        :return: indices of the boxes whose bounding box overlaps window, in the order of the text regions
+        """
+        return np.nonzero(self.overlap(window)[0])[0]
+
+
+def intersect_cropped_rawtxtreg(crop_img_poly, raw_img_txtregion, tl_x, tl_y, txtreg_index=None, candidates=None):
     """
     if the cropped image polygon intersected with raw text region
     1) stardard quardrange, has 4 point
@@ -26,16 +71,35 @@ def intersect_cropped_rawtxtreg(crop_img_poly, raw_img_txtregion, tl_x, tl_y):
     :param raw_img_txtregion: raw image's text region
     :param tl_x: cropped image's top-left x coordinates on raw image
     :param tl_y:
+    :param txtreg_index: TextRegionIndex of raw_img_txtregion, None means building it, build it once per image when
+                         cropping a image many times
+    :param candidates: indices of the boxes near the cropped image, None means txtreg_index.candidates, boxes whose
+                       bounding box does not overlap the cropped image never intersect it
     :return: true or false
     """
+    if txtreg_index is None:
+        txtreg_index = TextRegionIndex(raw_img_txtregion)
+    writ_crop_img, clipped = clip_cropped_rawtxtreg(crop_img_poly, txtreg_index, tl_x, tl_y, candidates)
+    intersec_coord = ['{0},{1},{2},{3},{4},{5},{6},{7},\n'.format(*coord) for coord in clipped]
+    return writ_crop_img, intersec_coord
+
+
+def clip_cropped_rawtxtreg(crop_img_poly, txtreg_index, tl_x, tl_y, candidates=None):
+    """
+    clip the text regions by a cropped image in memory, with the rules of intersect_cropped_rawtxtreg
+    :param crop_img_poly: cropped image polygon(shapely.geometry.Polygon's object)
+    :param txtreg_index: TextRegionIndex of raw image's text region
+    :param tl_x: cropped image's top-left x coordinates on raw image
+    :param tl_y:
+    :param candidates: indices of the boxes near the cropped image, None means txtreg_index.candidates
+    :return: A tuple (true or false, list of (x1, y1, x2, y2, x3, y3, x4, y4) on the cropped image)
+    """
+    if candidates is None:
+        candidates = txtreg_index.candidates(crop_img_poly.bounds)
     writ_crop_img = True
     intersec_coord = []
-    for polygon in raw_img_txtregion:
-        x1, y1 = string.atof(polygon[0]), string.atof(polygon[1])
-        x2, y2 = string.atof(polygon[2]), string.atof(polygon[3])
-        x3, y3 = string.atof(polygon[4]), string.atof(polygon[5])
-        x4, y4 = string.atof(polygon[6]), string.atof(polygon[7])
-        raw_img_poly = Polygon([(x1, y1), (x4, y4), (x3, y3), (x2, y2)])
+    for box_idx in candidates:
+        raw_img_poly = txtreg_index.polys[box_idx]
         if raw_img_poly.intersects(crop_img_poly):
             inter_poly = raw_img_poly.intersection(crop_img_poly)
             # the intersected quardrangle's aera is
@@ -60,11 +124,60 @@ def intersect_cropped_rawtxtreg(crop_img_poly, raw_img_txtregion, tl_x, tl_y):
             if len(list_inter) != 5:
                 writ_crop_img = False
                 break
-            strcoord = '{0},{1},{2},{3},{4},{5},{6},{7},\n'.format(x1, y1, x2, y2, x3, y3, x4, y4)
-            intersec_coord.append(strcoord)
+            intersec_coord.append((x1, y1, x2, y2, x3, y3, x4, y4))
     return writ_crop_img, intersec_coord
 
 
+def write_crop(jpgname, txtname, cropped_img, coord_lines):
+    """
+    write a cropped image and it's text region, each file is written to a temporary file and renamed into place,
+    the txt file is renamed last, so a jpg and txt pair is never seen half written and rewriting it replaces it
+    :param jpgname: jpg file path
+    :param txtname: txt file path
+    :param cropped_img: cropped image
+    :param coord_lines: list of text region line
+    """
+    _, encoded = cv2.imencode('.jpg', cropped_img)
+    for path, data in ((jpgname, encoded.tostring()), (txtname, ''.join(coord_lines))):
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+
+def capture_one_image_random(img, out_dir, size=320, cropped_num=300, rng=rd):
+    """
+    randomly crop one raw image, see capture_image_random
+    :param img: a dictionary, including image's path and text region coordinates
+    :param rng: random.Random object or the random module
+    :return: number of written cropped images
+    """
+    im = cv2.imread(img['imagePath'])
+    print img['imagePath']
+    if im is None or im.shape[0] < size or im.shape[1] < size:
+        return 0
+    # boxes are parsed once per image, all windows are tested against all bounding boxes in one numpy call
+    txtreg_index = TextRegionIndex(img['boxCoord'])
+    windows = np.array([(rng.randint(0, im.shape[1] - size), rng.randint(0, im.shape[0] - size))
+                        for _ in xrange(cropped_num)], dtype=np.int64).reshape(-1, 2)
+    overlap = txtreg_index.overlap(np.concatenate((windows, windows + size), axis=1))
+    num_written = 0
+    for i in xrange(cropped_num):
+        tl_x, tl_y = int(windows[i, 0]), int(windows[i, 1])
+        basename = os.path.basename(img['imagePath'])
+        image_name = basename.split('.')[0]
+        jpgname = out_dir + '/' + image_name + '_' + bytes(i) + '.jpg'
+        txtname = out_dir + '/' + image_name + '_' + bytes(i) + '.txt'
+        crop_img = Polygon([(tl_x, tl_y), (tl_x, tl_y + size), (tl_x + size, tl_y + size), (tl_x + size, tl_y)])
+        # use function to judge polygon crop_img whether intersect with raw image text region
+        writ_crop_img, intersec_coord = intersect_cropped_rawtxtreg(crop_img, img['boxCoord'], tl_x, tl_y,
+                                                                    txtreg_index, np.nonzero(overlap[i])[0])
+        if writ_crop_img:
+            write_crop(jpgname, txtname, im[tl_y: tl_y + size, tl_x: tl_x + size], intersec_coord)
+            num_written += 1
+    return num_written
+
+
 def capture_image_random(imgs, out_dir, size=320, cropped_num=300):
     """
     randomly choose a point as cropped image's top left coordinate, then each aixs add 320 pixel to generate
@@ -76,26 +189,7 @@ def capture_image_random(imgs, out_dir, size=320, cropped_num=300):
     :return: no returning, just writing jpg and txt fix in out_dir
     """
     for img in imgs:
-        im = cv2.imread(img['imagePath'])
-        print img['imagePath']
-        if im.shape[0] < size or im.shape[1] < size:
-            continue
-        for i in xrange(cropped_num):
-            tl_x = rd.randint(0, im.shape[1] - size)
-            tl_y = rd.randint(0, im.shape[0] - size)
-            basename = os.path.basename(img['imagePath'])
-            image_name = basename.split('.')[0]
-            jpgname = out_dir + '/' + image_name + '_' + bytes(i) + '.jpg'
-            txtname = out_dir + '/' + image_name + '_' + bytes(i) + '.txt'
-            crop_img = Polygon([(tl_x, tl_y), (tl_x, tl_y + size), (tl_x + size, tl_y + size), (tl_x + size, tl_y)])
-            # use function to judge polygon crop_img whether intersect with raw image text region
-            writ_crop_img, intersec_coord = intersect_cropped_rawtxtreg(crop_img, img['boxCoord'], tl_x, tl_y)
-            if writ_crop_img:
-                txtwrite = open(txtname, 'a')
-                for coord in intersec_coord:
-                    txtwrite.write(coord)
-                txtwrite.close()
-                cv2.imwrite(jpgname, im[tl_y: tl_y + size, tl_x: tl_x + size])
+        capture_one_image_random(img, out_dir, size, cropped_num)
 
 
 def get_croppedimg_tf_dr_coord(im, c, size=1000):
@@ -169,56 +263,129 @@ def cal_rotated_coord(co_line, t_m, cx, cy, w, h):
     :param h:
     :return: A string which include 4 corner's rotated coordinates
     """
-    coord = co_line.split(',')
-    x1, y1 = string.atof(coord[0]), string.atof(coord[1])
-    x2, y2 = string.atof(coord[2]), string.atof(coord[3])
-    x3, y3 = string.atof(coord[4]), string.atof(coord[5])
-    x4, y4 = string.atof(coord[6]), string.atof(coord[7])
-
-    text_reg = [[x1, y1], [x2, y2], [x3, y3], [x4, y4]]
-    rotated_text_reg = list(text_reg)
-    for i, coord in enumerate(text_reg):
-        # Grab the rotation components of the matrix)
-        cos = np.abs(t_m[0, 0])
-        sin = np.abs(t_m[0, 1])
-        # compute the new bounding dimensions of the image
-        nw = int((h * sin) + (w * cos))
-        nh = int((h * cos) + (w * sin))
-        # adjust the rotation matrix to take into account translation
-        t_m[0, 2] += (nw / 2) - cx
-        t_m[1, 2] += (nh / 2) - cy
-        # Prepare the vector to be transformed
-        v = [coord[0], coord[1], 1]
-        # Perform the actual rotation and return the image
-        calculated = np.dot(t_m, v)
-        rotated_text_reg[i] = (calculated[0], calculated[1])
-    strcoord = '{0},{1},{2},{3},{4},{5},{6},{7},\n'.format(rotated_text_reg[0][0], rotated_text_reg[0][1],
-                                                           rotated_text_reg[1][0], rotated_text_reg[1][1],
-                                                           rotated_text_reg[2][0], rotated_text_reg[2][1],
-                                                           rotated_text_reg[3][0], rotated_text_reg[3][1])
-    return strcoord
+    text_reg = np.array([string.atof(value) for value in co_line.split(',')[0:8]]).reshape(4, 2)
+    # Grab the rotation components of the matrix)
+    cos = np.abs(t_m[0, 0])
+    sin = np.abs(t_m[0, 1])
+    # compute the new bounding dimensions of the image
+    nw = int((h * sin) + (w * cos))
+    nh = int((h * cos) + (w * sin))
+    # adjust the rotation matrix to take into account translation, once for all corners and on a copy, t_m is
+    # not changed
+    t_m = np.array(t_m, dtype=np.float64)
+    t_m[0, 2] += (nw / 2) - cx
+    t_m[1, 2] += (nh / 2) - cy
+    # Perform the actual rotation of the 4 corners
+    rotated_text_reg = np.dot(text_reg, t_m[:, 0:2].T) + t_m[:, 2]
+    return '{0},{1},{2},{3},{4},{5},{6},{7},\n'.format(*rotated_text_reg.ravel())
 
 
-def rotate_img(cropped_img, outdir, base_name, idx, inter_co):
+def rot90_coords(txtreg, k, h, w):
+    """
+    coordinates of the text regions after np.rot90(img, k), the image is h * w before rotating
+    90: x' = y, y' = w - x; 180: x' = w - x, y' = h - y; 270: x' = h - y, y' = x
+    :param txtreg: text region numpy array (N, 8)
+    :param k: number of 90 degrees counter-clockwise rotations
+    :param h: image height before rotating
+    :param w: image width before rotating
+    :return: float64 numpy array (N, 8), vertices keep their order
+    """
+    points = np.asarray(txtreg, dtype=np.float64).reshape(-1, 2)
+    x, y = points[:, 0], points[:, 1]
+    k %= 4
+    if k == 0:
+        rotated = (x, y)
+    elif k == 1:
+        rotated = (y, w - x)
+    elif k == 2:
+        rotated = (w - x, h - y)
+    else:
+        rotated = (h - y, x)
+    return np.stack(rotated, axis=1).reshape(-1, 8)
 
+
+def rotate_crop(cropped_img, txtreg, angle):
+    """
+    rotate a cropped image and it's text region in memory, also used by rotate_img
+    right angles are exact: pixels are transposed and flipped by np.rot90 (no interpolation, a h * w crop becomes
+    w * h) and all coordinates are transformed at once; other angles are warped around the center on the same canvas
+    :param cropped_img: cropped image
+    :param txtreg: text region numpy array (N, 8) on the cropped image
+    :param angle: rotation angle in degrees, counter-clockwise
+    :return: A tuple (rotated image, rotated text region float64 numpy array (N, 8)), vertices keep their order
+    """
+    h, w = cropped_img.shape[:2]
+    if angle % 90 == 0:
+        k = int(angle // 90) % 4
+        return np.ascontiguousarray(np.rot90(cropped_img, k)), rot90_coords(txtreg, k, h, w)
+    tran_matrix = cv2.getRotationMatrix2D((w / 2.0, h / 2.0), angle, 1)
+    rotated = cv2.warpAffine(cropped_img, tran_matrix, (w, h))
+    points = np.asarray(txtreg, dtype=np.float64).reshape(-1, 2)
+    rotated_points = np.dot(points, tran_matrix[:, 0:2].T) + tran_matrix[:, 2]
+    return rotated, rotated_points.reshape(-1, 8)
+
+
+def rotate_img(cropped_img, outdir, base_name, idx, inter_co):
+    """
+    write the cropped image and it's text region rotated by 90, 180 and 270 degrees, see rotate_crop
+    :param cropped_img: cropped image
+    :param outdir: output directory name
+    :param base_name: raw image name
+    :param idx: index of the cropped image of the raw image
+    :param inter_co: list of text region line of the cropped image
+    """
+    # text region lines are parsed once for all angles
+    txtreg = np.array([[string.atof(value) for value in co_line.split(',')[0:8]] for co_line in inter_co],
+                      dtype=np.float64).reshape(-1, 8)
     angle_list = [90, 180, 270]
     for angle in angle_list:
         jpgname_90 = outdir + '/' + base_name + '_' + bytes(idx) + '_' + bytes(angle) + '.jpg'
         txtname_90 = outdir + '/' + base_name + '_' + bytes(idx) + '_' + bytes(angle) + '.txt'
-        (h, w) = (cropped_img.shape[1], cropped_img.shape[0])
-        center = (w / 2, h / 2)
-        tran_matrix = cv2.getRotationMatrix2D(center, angle, 1)
-        rotated90 = cv2.warpAffine(cropped_img, tran_matrix, (w, h))
-        rotated90_coord = []
-        for co_line in inter_co:
-            rotated_line = cal_rotated_coord(co_line, tran_matrix, center[0], center[1], w, h)
-            rotated90_coord.append(rotated_line)
-        txtwrite = open(txtname_90, 'a')
-        for ite in rotated90_coord:
-            txtwrite.write(ite)
-        txtwrite.close()
-
-        cv2.imwrite(jpgname_90, rotated90)
+        rotated90, rotated_txtreg = rotate_crop(cropped_img, txtreg, angle)
+        rotated90_coord = ['{0},{1},{2},{3},{4},{5},{6},{7},\n'.format(*coord) for coord in rotated_txtreg]
+        write_crop(jpgname_90, txtname_90, rotated90, rotated90_coord)
+
+
+def crop_one_image_from_textcenter(img, outdir, size=320, rotate=True):
+    """
+    crop one raw image around it's text region centers, see crop_image_from_textcenter
+    :param img: a dictionary, including image's path and text region coordinates
+    :param rotate: also write the cropped images rotated by 90, 180 and 270 degrees
+    :return: number of written cropped images (rotated ones not counted)
+    """
+    idx = 1
+    im = cv2.imread(img['imagePath'])
+    print img['imagePath']
+    if im is None or im.shape[0] < size and im.shape[1] < size:
+        return 0
+    # boxes are parsed once per image
+    txtreg_index = TextRegionIndex(img['boxCoord'])
+    for coord in txtreg_index.coords:
+        # calculate the text region's center coordinate
+        text_cen = [(coord[0] + coord[4]) / 2, (coord[1] + coord[5]) / 2]
+        # get cropped image's top-left and down-right coordinate
+        [t_l, d_r] = get_croppedimg_tl_dr_coord_ver2(im, text_cen, size)
+        if t_l is None or d_r is None:
+            continue
+        # calculate cropped image's top-right and down-left coordinates
+        t_r = [d_r[0], t_l[1]]
+        d_l = [t_l[0], d_r[1]]
+        # using shapely lib define a cropped image's polygon
+        crop_img = Polygon([(t_l[0], t_l[1]), (d_l[0], d_l[1]), (d_r[0], d_r[1]), (t_r[0], t_r[1])])
+        base_name = img['imagePath'].split('/')[-1].split('.')[0]
+        jpgname = outdir + '/' + base_name + '_' + bytes(idx) + '.jpg'
+        txtname = outdir + '/' + base_name + '_' + bytes(idx) + '.txt'
+        # use function to judge cropped image whether intersect with raw image's text regions
+        # generate cropped image's txt file
+        write_bool, inter_co = intersect_cropped_rawtxtreg(crop_img, img['boxCoord'], t_l[0], t_l[1],
+                                                           txtreg_index)
+        if write_bool:
+            cropped_img = im[int(t_l[1]): int(t_l[1]) + size, int(t_l[0]): int(t_l[0]) + size]
+            write_crop(jpgname, txtname, cropped_img, inter_co)
+            if rotate:
+                rotate_img(cropped_img, outdir, base_name, idx, inter_co)
+            idx += 1
+    return idx - 1
 
 
 def crop_image_from_textcenter(imgs, outdir, size=320):
@@ -230,44 +397,76 @@ def crop_image_from_textcenter(imgs, outdir, size=320):
     :return: no returning value, write image(320 * 320) and corresponding txt file on disk
     """
     for img in imgs:
-        idx = 1
-        im = cv2.imread(img['imagePath'])
-        print img['imagePath']
-        if im.shape[0] < size and im.shape[1] < size:
-            continue
-        for coord in img['boxCoord']:
-            # calculate the text region's center coordinate
-            text_cen = [(string.atof(coord[0]) + string.atof(coord[4])) / 2,
-                        (string.atof(coord[1]) + string.atof(coord[5])) / 2]
-            # get cropped image's top-left and down-right coordinate
-            [t_l, d_r] = get_croppedimg_tl_dr_coord_ver2(im, text_cen, size)
-            if t_l is None or d_r is None:
-                continue
-            # calculate cropped image's top-right and down-left coordinates
-            t_r = [d_r[0], t_l[1]]
-            d_l = [t_l[0], d_r[1]]
-            # using shapely lib define a cropped image's polygon
-            crop_img = Polygon([(t_l[0], t_l[1]), (d_l[0], d_l[1]), (d_r[0], d_r[1]), (t_r[0], t_r[1])])
-            base_name = img['imagePath'].split('/')[-1].split('.')[0]
-            jpgname = outdir + '/' + base_name + '_' + bytes(idx) + '.jpg'
-            txtname = outdir + '/' + base_name + '_' + bytes(idx) + '.txt'
-            # use function to judge cropped image whether intersect with raw image's text regions
-            # generate cropped image's txt file
-            write_bool, inter_co = intersect_cropped_rawtxtreg(crop_img, img['boxCoord'], t_l[0], t_l[1])
-            if write_bool:
-                txtwrite = open(txtname, 'a')
-                for co in inter_co:
-                    txtwrite.write(co)
-                txtwrite.close()
-                cropped_img = im[int(t_l[1]): int(t_l[1]) + size, int(t_l[0]): int(t_l[0]) + size]
-                cv2.imwrite(jpgname, cropped_img)
-                rotate = True
-                if rotate:
-                    rotate_img(cropped_img, outdir, base_name, idx, inter_co)
-                idx += 1
+        crop_one_image_from_textcenter(img, outdir, size)
+
+
+def _crop_worker(args):
+    """
+    crop one raw image in a worker process of crop_dataset
+    :param args: A tuple (image dictionary, output directory, mode, size, cropped_num)
+    :return: A tuple (raw image path, number of written cropped images)
+    """
+    img, outdir, mode, size, cropped_num = args
+    if mode == 'textcenter':
+        return img['imagePath'], crop_one_image_from_textcenter(img, outdir, size)
+    # random windows only depend on the image name, so a restarted run crops the same windows
+    rng = rd.Random(zlib.crc32(os.path.basename(img['imagePath'])))
+    return img['imagePath'], capture_one_image_random(img, outdir, size, cropped_num, rng)
+
+
+def read_journal(outdir):
+    """
+    :param outdir: crop output directory
+    :return: set of finished raw image path
+    """
+    journal_path = os.path.join(outdir, JOURNAL_NAME)
+    if not os.path.isfile(journal_path):
+        return set()
+    with open(journal_path, 'r') as f:
+        # a line without newline is a interrupted write, the image is not finished
+        return set(line[:-1] for line in f if line.endswith('\n'))
+
+
+def crop_dataset(imgs, outdir, mode='textcenter', size=320, cropped_num=300, processes=None):
+    """
+    crop raw images in a process pool, resumable
+    every finished raw image is appended to the journal in outdir, a restarted run skips the finished images, the
+    outputs of a interrupted image are rewritten, not appended to (see write_crop)
+    :param imgs: a list, each elements is a dictionary, including image's path and text region coordinates
+    :param outdir: output directory, created if not exist
+    :param mode: 'textcenter' (crop_image_from_textcenter) or 'random' (capture_image_random)
+    :param size: cropped image's size
+    :param cropped_num: the number of random windows of a image, only for 'random'
+    :param processes: number of worker processes, None means the number of cpus
+    :return: A tuple (number of processed raw images, number of written cropped images)
+    """
+    if mode not in ('textcenter', 'random'):
+        raise ValueError('unknown crop mode {0}'.format(mode))
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    finished = read_journal(outdir)
+    tasks = [(img, outdir, mode, size, cropped_num) for img in imgs if img['imagePath'] not in finished]
+    print '{0} raw images, {1} finished, {2} to crop'.format(len(imgs), len(imgs) - len(tasks), len(tasks))
+    num_cropped = 0
+    pool = multiprocessing.Pool(processes)
+    try:
+        with open(os.path.join(outdir, JOURNAL_NAME), 'a') as journal:
+            for img_path, num_written in pool.imap_unordered(_crop_worker, tasks):
+                journal.write(img_path + '\n')
+                journal.flush()
+                num_cropped += num_written
+    finally:
+        pool.close()
+        pool.join()
+    return len(tasks), num_cropped
 
 
 if __name__ == '__main__':
-    all_imgs, numFileTxt = get_data.get_raw_data('/home/yuquanjie/Documents/Dataset/icdar/icdar')
-    crop_image_from_textcenter(all_imgs, '/home/yuquanjie/Documents/Dataset/icdar/crop_center_rotated', 320)
+    # python -m tools.resize_Image [raw image dir] [output dir] [textcenter or random] [processes]
+    raw_dir = sys.argv[1] if len(sys.argv) > 1 else '/home/yuquanjie/Documents/Dataset/icdar/icdar'
+    crop_dir = sys.argv[2] if len(sys.argv) > 2 else '/home/yuquanjie/Documents/Dataset/icdar/crop_center_rotated'
+    all_imgs, numFileTxt = get_data.get_raw_data(raw_dir)
+    num_imgs, num_crops = crop_dataset(all_imgs, crop_dir, sys.argv[3] if len(sys.argv) > 3 else 'textcenter',
+                                       320, processes=int(sys.argv[4]) if len(sys.argv) > 4 else None)
+    print 'cropped {0} raw images into {1} images'.format(num_imgs, num_crops)
 
@@ -0,0 +1,182 @@
+import os
+import hashlib
+import tempfile
+import zipfile
+import numpy as np
+import cv2
+
+# libjpeg scales by 1/2, 1/4 or 1/8 while decoding (DCT scaling), much cheaper than decoding at full size
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# JPEG start of frame markers, the frame header holds the image size
+SOF_MARKERS = set([0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf])
+
+
+def jpeg_size(data):
+    """
+    read the image size from the JPEG frame header without decoding
+    :param data: encoded jpg bytes, the first few kilobytes are enough unless there is a large EXIF thumbnail
+    :return: A tuple (height, width), None if data is not a JPEG or the frame header is not found
+    """
+    if data[:2] != '\xff\xd8':
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != '\xff':
+            return None
+        marker = ord(data[pos + 1])
+        # fill bytes
+        if marker == 0xff:
+            pos += 1
+            continue
+        # markers without segment
+        if marker == 0x01 or 0xd0 <= marker <= 0xd7:
+            pos += 2
+            continue
+        length = ord(data[pos + 2]) * 256 + ord(data[pos + 3])
+        if marker in SOF_MARKERS:
+            if pos + 9 > len(data):
+                return None
+            height = ord(data[pos + 5]) * 256 + ord(data[pos + 6])
+            width = ord(data[pos + 7]) * 256 + ord(data[pos + 8])
+            return height, width
+        pos += 2 + length
+    return None
+
+
+def reduced_factor(height, width, size):
+    """
+    :param height: image height
+    :param width: image width
+    :param size: target size, the image is resized to (size, size)
+    :return: largest DCT scaling factor keeping both sides at least size, 1 means decoding at full size
+    """
+    for factor, _ in REDUCED_FLAGS:
+        if height // factor >= size and width // factor >= size:
+            return factor
+    return 1
+
+
+def read_jpeg_size(jpg_path, head_bytes=64 * 1024):
+    """
+    :param jpg_path: jpg file path
+    :param head_bytes: number of bytes read first, the whole file is read if the frame header is not in them
+    :return: A tuple (height, width), None if the file is not a JPEG
+    """
+    with open(jpg_path, 'rb') as f:
+        data = f.read(head_bytes)
+        full_size = jpeg_size(data)
+        if full_size is None and len(data) == head_bytes:
+            full_size = jpeg_size(data + f.read())
+    return full_size
+
+
+def decode_resized(jpg_path, size=320, interpolation=cv2.INTER_CUBIC, reduced=True):
+    """
+    read a jpg and resize it to (size, size), decoded at reduced scale when the downscale factor allows it
+    (cv2.imdecode ignores the reduced flags in some opencv versions, so the file is read with cv2.imread)
+    :param jpg_path: jpg file path
+    :param size: target size
+    :param interpolation: cv2 interpolation of resizing
+    :param reduced: decode at reduced scale, False means decoding at full size (same as cv2.imread)
+    :return: A tuple (resized image, (height, width) of the full size image), None if the jpg is not decodable
+    """
+    full_size = read_jpeg_size(jpg_path) if reduced else None
+    factor = reduced_factor(full_size[0], full_size[1], size) if full_size is not None else 1
+    if factor == 1:
+        img = cv2.imread(jpg_path, cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        full_size = img.shape[:2]
+    else:
+        img = cv2.imread(jpg_path, dict(REDUCED_FLAGS)[factor])
+        if img is None:
+            return None
+        # EXIF orientation is applied while decoding, the frame header has the size before rotating
+        if (img.shape[0] > img.shape[1]) != (full_size[0] > full_size[1]):
+            full_size = full_size[::-1]
+    return cv2.resize(img, (size, size), interpolation=interpolation), tuple(full_size)
+
+
+class ResizedCache(object):
+    """
+    on-disk cache of resized full images, for training on the original (about 2400 * 3200) images
+    each entry is keyed by the jpg content and the resize parameters, so renamed or copied images hit the cache and
+    modified images miss it, repeat epochs skip both decoding at full size and resizing
+    entries are never evicted, one entry is size * size * 3 bytes plus a small header
+    """
+    def __init__(self, cache_dir, size=320, interpolation=cv2.INTER_CUBIC, reduced=True):
+        """
+        :param cache_dir: cache directory, created if not exist
+        :param size: target size
+        :param interpolation: cv2 interpolation of resizing
+        :param reduced: decode at reduced scale on cache misses, see decode_resized
+        """
+        self.cache_dir = cache_dir
+        self.size = size
+        self.interpolation = interpolation
+        self.reduced = reduced
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, data):
+        """
+        :param data: encoded jpg bytes
+        :return: hex digest of jpg content and resize parameters
+        """
+        sha = hashlib.sha1(data)
+        sha.update(','.join(str(param) for param in (self.size, self.interpolation, self.reduced)))
+        return sha.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def get(self, key):
+        """
+        :param key: key of a entry
+        :return: A tuple (resized image, (height, width) of the full size image), None if not cached
+        """
+        try:
+            with np.load(self._path(key)) as entry:
+                img, full_size = entry['img'], tuple(entry['full_size'])
+        except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return img, full_size
+
+    def put(self, key, img, full_size):
+        """
+        write a entry, the file is renamed into place so concurrent readers never see a partial entry
+        :param key: key of a entry
+        :param img: resized image
+        :param full_size: (height, width) of the full size image
+        """
+        path = self._path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # created by another process
+                pass
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, img=img, full_size=np.array(full_size, dtype=np.int64))
+        os.rename(tmp_path, path)
+
+    def read(self, jpg_path):
+        """
+        read a resized image through the cache
+        :param jpg_path: jpg file path
+        :return: A tuple (resized image, (height, width) of the full size image), None if the jpg is not decodable
+        """
+        with open(jpg_path, 'rb') as f:
+            data = f.read()
+        key = self.key(data)
+        entry = self.get(key)
+        if entry is None:
+            entry = decode_resized(jpg_path, self.size, self.interpolation, self.reduced)
+            if entry is not None:
+                self.put(key, *entry)
+        return entry
@@ -0,0 +1,114 @@
+import os
+import json
+import numpy as np
+
+
+class EpochSampler(object):
+    """
+    sample indices epoch by epoch, every sample is drawn exactly once per epoch
+    the order of a epoch only depends on (seed, epoch), so runs with the same seed see the same data in the same order
+    the indices of a epoch can be split into num_shards disjoint shards, shard k takes every num_shards-th index
+    starting at k, so several loader processes cover the data once without overlap
+    the cursor (epoch, position) can be saved and restored to resume a run in the middle of a epoch
+    """
+    def __init__(self, num_samples, seed=0, shuffle=True, num_shards=1, shard_index=0):
+        """
+        :param num_samples: number of samples
+        :param seed: random seed of shuffling
+        :param shuffle: shuffle samples every epoch, False means the natural order
+        :param num_shards: number of loader workers or processes sharing the samples
+        :param shard_index: index of this shard, 0 <= shard_index < num_shards
+        """
+        if not 0 <= shard_index < num_shards:
+            raise ValueError('shard index {0} is not in [0, {1})'.format(shard_index, num_shards))
+        self.num_samples = num_samples
+        self.seed = seed
+        self.shuffle = shuffle
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        self.epoch = 0
+        self.position = 0
+        self._epoch_cache = (None, None)
+
+    def __len__(self):
+        # number of indices of this shard in one epoch, shards differ by at most one
+        return len(xrange(self.shard_index, self.num_samples, self.num_shards))
+
+    def epoch_indices(self, epoch):
+        """
+        :param epoch: epoch number
+        :return: int64 numpy array, indices of this shard in epoch
+        """
+        if self._epoch_cache[0] != epoch:
+            if self.shuffle:
+                order = np.random.RandomState([self.seed, epoch]).permutation(self.num_samples)
+            else:
+                order = np.arange(self.num_samples)
+            self._epoch_cache = (epoch, order[self.shard_index::self.num_shards].astype(np.int64))
+        return self._epoch_cache[1]
+
+    def set_epoch(self, epoch):
+        """
+        move the cursor to the beginning of epoch, e.g. initial_epoch of fit_generator
+        :param epoch: epoch number
+        """
+        self.epoch = epoch
+        self.position = 0
+
+    def iter_epoch(self):
+        """
+        iterate from the cursor to the end of the current epoch, then move the cursor to the next epoch
+        the cursor moves as indices are handed out, note that batches queued by fit_generator are ahead of the
+        trained batches
+        """
+        indices = self.epoch_indices(self.epoch)
+        while self.position < len(indices):
+            self.position += 1
+            yield int(indices[self.position - 1])
+        self.epoch += 1
+        self.position = 0
+
+    def __iter__(self):
+        """
+        endless iteration from the cursor, epoch after epoch
+        """
+        while True:
+            for idx in self.iter_epoch():
+                yield idx
+
+    def state(self):
+        """
+        :return: dict, the cursor and the parameters it is valid for
+        """
+        return {'num_samples': self.num_samples, 'seed': self.seed, 'shuffle': self.shuffle,
+                'num_shards': self.num_shards, 'shard_index': self.shard_index,
+                'epoch': self.epoch, 'position': self.position}
+
+    def set_state(self, state):
+        """
+        restore the cursor, ValueError if state is from a sampler of other samples or shards
+        :param state: dict returned by state
+        """
+        for key in ('num_samples', 'seed', 'shuffle', 'num_shards', 'shard_index'):
+            if state[key] != getattr(self, key):
+                raise ValueError('sampler {0} is {1}, saved cursor is for {2}'.format(key, getattr(self, key),
+                                                                                     state[key]))
+        self.epoch = state['epoch']
+        self.position = state['position']
+
+    def save_state(self, state_path):
+        """
+        write the cursor as json, written to a temporary file and renamed into place
+        :param state_path: json file path
+        """
+        tmp_path = '{0}.{1}.tmp'.format(state_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state(), f)
+        os.rename(tmp_path, state_path)
+
+    def load_state(self, state_path):
+        """
+        :param state_path: json file written by save_state
+        """
+        with open(state_path, 'r') as f:
+            self.set_state(json.load(f))
@@ -0,0 +1,186 @@
+import os
+import sys
+import numpy as np
+import cv2
+import h5py
+import tools.annotation_store as annotation_store
+import tools.label_engine as label_engine
+import tools.geometry as geometry
+
+# index file of a shard directory, shard file names and the text regions of all samples
+INDEX_NAME = 'index.npz'
+SHARD_NAME = 'shard-{0:05d}.h5'
+
+
+def is_shard_dir(directory):
+    """
+    :param directory: a directory
+    :return: True if directory is written by write_shards
+    """
+    return os.path.isfile(os.path.join(directory, INDEX_NAME))
+
+
+def _write_shard(shard_path, store, indices, crop_size, geom, compression):
+    """
+    write one shard, encoded jpg bytes are copied from the jpg files without decoding
+    :param indices: image indices of the annotation store in this shard
+    """
+    tmp_path = '{0}.{1}.tmp'.format(shard_path, os.getpid())
+    coords = [store.txtreg(idx) for idx in indices]
+    offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(txtreg) for txtreg in coords])
+    with h5py.File(tmp_path, 'w') as f:
+        jpeg = f.create_dataset('jpeg', (len(indices), ), dtype=h5py.special_dtype(vlen=np.dtype('uint8')))
+        for row, idx in enumerate(indices):
+            with open(store.path(idx), 'rb') as jpg_file:
+                jpeg[row] = np.frombuffer(jpg_file.read(), dtype=np.uint8)
+        f.create_dataset('names', data=np.array([os.path.basename(store.path(idx)) for idx in indices]))
+        f.create_dataset('coords', data=np.concatenate(coords or [np.zeros((0, 8), dtype=np.float32)]))
+        f.create_dataset('offsets', data=offsets)
+        if geom is not None:
+            # targets are mostly zeros, chunks of one sample compress well
+            out_size = geom.out_size
+            labels = f.create_dataset('y_regr_cls_mask', (len(indices), out_size, out_size, 10),
+                                      dtype=label_engine.REGR_DTYPE, chunks=(1, out_size, out_size, 10),
+                                      compression=compression)
+            for row, idx in enumerate(indices):
+                labels[row] = label_engine.gene_labels((crop_size, crop_size), store.txtreg(idx), geom)[1]
+            f.attrs['input_size'], f.attrs['stride'] = geom.input_size, geom.stride
+    os.rename(tmp_path, shard_path)
+
+
+def write_shards(store, shard_dir, samples_per_shard=4096, crop_size=320, geom=None, compression='lzf'):
+    """
+    pack the images of a annotation store into shards, each shard is a h5 file holding
+    'jpeg', encoded jpg bytes of each sample
+    'names', jpg file name of each sample
+    'coords' and 'offsets', text regions of sample i are coords[offsets[i]:offsets[i + 1]]
+    'y_regr_cls_mask', optional, the targets of label_engine.gene_labels
+    :param store: annotation_store.AnnotationStore object
+    :param shard_dir: output directory, created if not exist
+    :param samples_per_shard: number of samples of each shard
+    :param crop_size: cropped image size
+    :param geom: geometry.Geometry object, None means not storing targets
+    :param compression: h5py compression of the targets, 'lzf', 'gzip' or None
+    :return: number of shards
+    """
+    if not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+    shard_names = []
+    for start in xrange(0, len(store), samples_per_shard):
+        shard_names.append(SHARD_NAME.format(len(shard_names)))
+        print '\twriting {0}, {1}/{2}'.format(shard_names[-1], start, len(store))
+        indices = range(start, min(start + samples_per_shard, len(store)))
+        _write_shard(os.path.join(shard_dir, shard_names[-1]), store, indices, crop_size, geom, compression)
+    # the index is written last, a shard directory without index is incomplete
+    shard_offsets = np.arange(len(shard_names) + 1, dtype=np.int64) * samples_per_shard
+    shard_offsets[-1] = len(store)
+    tmp_path = os.path.join(shard_dir, '{0}.{1}.tmp'.format(INDEX_NAME, os.getpid()))
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, shard_names=np.array(shard_names, dtype=str), shard_offsets=shard_offsets,
+                 names=np.array([os.path.basename(store.path(idx)) for idx in xrange(len(store))], dtype=str),
+                 coords=store.coords, offsets=store.offsets)
+    os.rename(tmp_path, os.path.join(shard_dir, INDEX_NAME))
+    return len(shard_names)
+
+
+class ShardReader(object):
+    """
+    random access to the samples of a shard directory by sample index, same interface as
+    annotation_store.AnnotationStore, so the loaders can read shards in place of jpg and txt files
+    text regions are read from the index, shard files are opened on first use in each process
+    """
+    def __init__(self, shard_dir):
+        """
+        :param shard_dir: directory written by write_shards
+        """
+        self.shard_dir = shard_dir
+        with np.load(os.path.join(shard_dir, INDEX_NAME)) as index:
+            self.shard_names = index['shard_names'].tolist()
+            self.shard_offsets = index['shard_offsets']
+            self.names = index['names'].tolist()
+            self.coords = index['coords']
+            self.offsets = index['offsets']
+        self._files = {}
+        self._pid = None
+        self._name_index = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _shard_file(self, shard_idx):
+        # h5 files opened before fork can not be shared by worker processes, reopen them in each process
+        if self._pid != os.getpid():
+            self._files = {}
+            self._pid = os.getpid()
+        if shard_idx not in self._files:
+            self._files[shard_idx] = h5py.File(os.path.join(self.shard_dir, self.shard_names[shard_idx]), 'r')
+        return self._files[shard_idx]
+
+    def locate(self, idx):
+        """
+        :param idx: sample index
+        :return: A tuple (shard index, row in the shard)
+        """
+        shard_idx = int(np.searchsorted(self.shard_offsets, idx, side='right')) - 1
+        return shard_idx, int(idx - self.shard_offsets[shard_idx])
+
+    def path(self, idx):
+        """
+        :param idx: sample index
+        :return: jpg file name of the sample under the shard directory, unique across shard directories
+        """
+        return os.path.join(self.shard_dir, self.names[idx])
+
+    def index(self, name):
+        """
+        :param name: jpg file name
+        :return: sample index, KeyError if the sample is not in the shards
+        """
+        if self._name_index is None:
+            self._name_index = dict((name, idx) for idx, name in enumerate(self.names))
+        return self._name_index[os.path.basename(name)]
+
+    def txtreg(self, idx):
+        """
+        :param idx: sample index
+        :return: float32 numpy array, shape (number of boxes, 8)
+        """
+        return self.coords[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def read_jpeg(self, idx):
+        """
+        :param idx: sample index
+        :return: uint8 numpy array, encoded jpg bytes
+        """
+        shard_idx, row = self.locate(idx)
+        return self._shard_file(shard_idx)['jpeg'][row]
+
+    def read_image(self, idx):
+        """
+        :param idx: sample index
+        :return: decoded image, same as cv2.imread, None if not decodable
+        """
+        return cv2.imdecode(self.read_jpeg(idx), cv2.IMREAD_COLOR)
+
+    def labels(self, idx, geom):
+        """
+        :param idx: sample index
+        :param geom: geometry.Geometry object
+        :return: A tuple (y_cls_mask_label, y_regr_cls_mask_label), None if the shards have no targets of geom
+        """
+        shard_idx, row = self.locate(idx)
+        shard_file = self._shard_file(shard_idx)
+        if 'y_regr_cls_mask' not in shard_file or shard_file.attrs['input_size'] != geom.input_size \
+                or shard_file.attrs['stride'] != geom.stride:
+            return None
+        y_regr_cls_mask_label = shard_file['y_regr_cls_mask'][row]
+        return y_regr_cls_mask_label[:, :, 8:10].astype(label_engine.CLS_MASK_DTYPE), y_regr_cls_mask_label
+
+
+if __name__ == '__main__':
+    # python -m tools.shard crop_dir shard_dir [samples_per_shard] [geometry name of stored targets]
+    samples = int(sys.argv[3]) if len(sys.argv) > 3 else 4096
+    targets_geom = geometry.get_geometry(sys.argv[4]) if len(sys.argv) > 4 else None
+    num_shards = write_shards(annotation_store.load_or_build(sys.argv[1]), sys.argv[2], samples, geom=targets_geom)
+    print 'wrote {0} shards into {1}'.format(num_shards, sys.argv[2])
@@ -0,0 +1,111 @@
+import os
+import sys
+import errno
+import numpy as np
+import tools.manifest as manifest
+import tools.annotation_store as annotation_store
+
+# split list of directory a/b named train is a/b.split-train.txt, next to the directory like the manifest
+SPLIT_NAME = '{0}.split-{1}' + annotation_store.SPLIT_SUFFIX
+
+
+def split_path(directory, name):
+    """
+    :param directory: image directory
+    :param name: split name, e.g. 'train', 'val' or 'train_1'
+    :return: split list file path
+    """
+    return SPLIT_NAME.format(os.path.normpath(directory), name)
+
+
+def split_indices(num_samples, ratios=None, chunk_size=None, seed=0, shuffle=True):
+    """
+    split sample indices by ratios or into chunks of fixed size, the result only depends on (num_samples, seed)
+    :param num_samples: number of samples
+    :param ratios: list of split ratio, normalized by their sum, e.g. (0.8, 0.1, 0.1)
+    :param chunk_size: number of samples of each split, the last split has the remaining samples, used if ratios is
+                       None
+    :param seed: random seed of shuffling
+    :param shuffle: shuffle samples before splitting, False means the natural order
+    :return: list of int64 numpy array, disjoint sample indices of each split, all samples are in one split
+    """
+    if shuffle:
+        order = np.random.RandomState(seed).permutation(num_samples).astype(np.int64)
+    else:
+        order = np.arange(num_samples, dtype=np.int64)
+    if ratios is not None:
+        ratios = np.asarray(ratios, dtype=np.float64)
+        if len(ratios) == 0 or (ratios < 0).any() or ratios.sum() <= 0:
+            raise ValueError('invalid split ratios {0}'.format(ratios.tolist()))
+        bounds = np.round(np.cumsum(ratios) / ratios.sum() * num_samples).astype(np.int64)
+    elif chunk_size is not None and chunk_size > 0:
+        bounds = np.arange(chunk_size, num_samples + chunk_size, chunk_size, dtype=np.int64)
+        bounds[-1:] = num_samples
+    else:
+        raise ValueError('either ratios or a positive chunk size is needed')
+    return np.split(order, bounds[:-1])
+
+
+def link_split(jpg_paths, out_dir):
+    """
+    hard link the jpg and txt files of a split into a directory, for tools which need a physical layout
+    no data is copied, existing files are kept, the directory must be on the same file system as the images
+    :param jpg_paths: list of jpg file path
+    :param out_dir: output directory, created if not exist
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    for jpg_path in jpg_paths:
+        for src in (jpg_path, os.path.splitext(jpg_path)[0] + '.txt'):
+            try:
+                os.link(src, os.path.join(out_dir, os.path.basename(src)))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+
+def split_directory(directory, names=None, ratios=None, chunk_size=None, seed=0, shuffle=True, link_root=None):
+    """
+    split the images of a directory and write one split list per split, see split_indices
+    the images come from the directory's annotation store, so only valid samples (see tools.check_dataset) are split
+    a split list can be passed to all_train.load_source and get_data.gene_h5_train_file in place of a directory
+    :param directory: directory of jpg and txt files
+    :param names: list of split name, None means train_1, train_2, ...
+    :param ratios: list of split ratio, see split_indices
+    :param chunk_size: number of samples of each split, see split_indices
+    :param seed: random seed of shuffling
+    :param shuffle: shuffle samples before splitting
+    :param link_root: directory of hard linked split directories link_root/name, None means only writing the lists
+    :return: list of split list file path
+    """
+    store = annotation_store.load_or_build(directory)
+    parts = split_indices(len(store), ratios, chunk_size, seed, shuffle)
+    if names is None:
+        names = ['train_{0}'.format(idx + 1) for idx in xrange(len(parts))]
+    if len(names) != len(parts):
+        raise ValueError('{0} split names for {1} splits'.format(len(names), len(parts)))
+    list_paths = []
+    for name, part in zip(names, parts):
+        jpg_paths = [store.path(idx) for idx in part]
+        list_paths.append(split_path(directory, name))
+        manifest.save_valid_list(jpg_paths, list_paths[-1])
+        if link_root is not None:
+            link_split(jpg_paths, os.path.join(link_root, name))
+    return list_paths
+
+
+if __name__ == '__main__':
+    # python -m tools.split_dataset image_dir name:ratio [name:ratio ...] [seed] [link_root]
+    # python -m tools.split_dataset image_dir chunk_size [seed] [link_root], splits are named train_1, train_2, ...
+    args = sys.argv[2:]
+    if ':' in args[0]:
+        split_args = [arg.split(':') for arg in args if ':' in arg]
+        args = [arg for arg in args if ':' not in arg]
+        split_names, split_chunk = [name for name, _ in split_args], None
+        split_ratios = [float(ratio) for _, ratio in split_args]
+    else:
+        split_names, split_ratios, split_chunk = None, None, int(args.pop(0))
+    paths = split_directory(sys.argv[1], split_names, split_ratios, split_chunk, int(args[0]) if args else 0,
+                            link_root=args[1] if len(args) > 1 else None)
+    for path in paths:
+        print '\t{0}: {1} images'.format(path, len(manifest.load_valid_list(path)))